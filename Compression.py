@@ -0,0 +1,331 @@
+import math
+import sys
+from array import array
+from itertools import accumulate
+
+# binary postings files start with this line so Postings can tell them apart from text ones
+MAGIC = b"VBPOSTINGS1\n"
+
+# the record header stores the kind of record in its low bits
+KIND_BITS = 3
+KIND_GAPS = 0
+KIND_BITMAP = 1
+
+# bitmap records group doc ids into containers by their high bits, like Roaring bitmaps
+CONTAINER_BITS = 16
+CONTAINER_BYTES = (1 << CONTAINER_BITS) // 8
+# containers with more doc ids than this are stored as bitmaps, smaller ones as arrays of their low bits
+ARRAY_CONTAINER_MAX = CONTAINER_BYTES // 2
+
+
+def vb_encode_number(n, out):
+    '''
+    variable byte encodes a single non-negative integer into the bytearray out
+    7 bits per byte, most significant group first, high bit set on the last byte
+    '''
+    groups = [n & 0x7f]
+    n >>= 7
+    while n:
+        groups.append(n & 0x7f)
+        n >>= 7
+    groups[0] |= 0x80
+    out.extend(reversed(groups))
+
+
+def vb_decode(buffer, position, count):
+    '''
+    decodes count numbers from buffer starting at position
+    returns (list of numbers, position after the last byte read)
+    '''
+    numbers = []
+    n = 0
+    while len(numbers) < count:
+        byte = buffer[position]
+        position += 1
+        if byte < 0x80:
+            n = (n << 7) | byte
+        else:
+            numbers.append((n << 7) | (byte & 0x7f))
+            n = 0
+    return numbers, position
+
+
+# clears the continuation bit of every byte, which decodes a run of single byte numbers at once
+SINGLE_BYTE_TABLE = bytes(byte & 0x7f for byte in range(256))
+
+
+def vb_decode_stream(buffer, position, length):
+    '''
+    decodes every number in buffer[position:position + length]
+    faster than vb_decode when the end position is already known
+    '''
+    data = bytes(buffer[position:position + length])
+    if min(data, default=0x80) >= 0x80:
+        # every number fits in a single byte
+        return data.translate(SINGLE_BYTE_TABLE)
+    numbers = []
+    append = numbers.append
+    n = 0
+    for byte in data:
+        if byte < 0x80:
+            n = (n << 7) | byte
+        else:
+            append((n << 7) | (byte & 0x7f))
+            n = 0
+    return numbers
+
+
+def skip_distance(length):
+    '''
+    same skip spacing as PostingList
+    '''
+    if length <= 3:
+        return 0
+    return round(math.sqrt(length))
+
+
+def encode_posting(doc_ids):
+    '''
+    encodes a sorted sequence of doc ids as
+    header (df << KIND_BITS | kind), doc id stream length, gap-encoded doc ids
+    postings are always decoded whole and intersected with the implicit skips of PostingList,
+    so records carry no skip table
+    '''
+    data = bytearray()
+    previous = 0
+    count = 0
+    for doc_id in doc_ids:
+        vb_encode_number(doc_id - previous, data)
+        previous = doc_id
+        count += 1
+
+    record = bytearray()
+    vb_encode_number(count << KIND_BITS | KIND_GAPS, record)
+    vb_encode_number(len(data), record)
+    record.extend(data)
+    return bytes(record)
+
+
+def encode_bitmap_posting(doc_ids):
+    '''
+    encodes a sorted sequence of doc ids as
+    header (df << KIND_BITS | KIND_BITMAP), container count, then for each container of doc ids sharing their
+    high CONTAINER_BITS bits: (gap from the previous high bits, doc ids - 1) and either a sorted array of
+    16-bit low bits or, above ARRAY_CONTAINER_MAX doc ids, a bitmap of CONTAINER_BYTES bytes
+    '''
+    containers = {}
+    for doc_id in doc_ids:
+        containers.setdefault(doc_id >> CONTAINER_BITS, []).append(doc_id & 0xffff)
+    record = bytearray()
+    vb_encode_number(len(doc_ids) << KIND_BITS | KIND_BITMAP, record)
+    vb_encode_number(len(containers), record)
+    previous_key = 0
+    for key, lows in containers.items():
+        vb_encode_number(key - previous_key, record)
+        vb_encode_number(len(lows) - 1, record)
+        previous_key = key
+        if len(lows) > ARRAY_CONTAINER_MAX:
+            bitmap = bytearray(CONTAINER_BYTES)
+            for low in lows:
+                bitmap[low >> 3] |= 1 << (low & 7)
+            record.extend(bitmap)
+        else:
+            lows = array('H', lows)
+            if sys.byteorder == 'big':
+                lows.byteswap()
+            record.extend(lows.tobytes())
+    return bytes(record)
+
+
+def encode_record(doc_ids, dense = False):
+    '''
+    encodes doc ids as a gap record, or for dense postings as a bitmap record if that is smaller
+    '''
+    record = encode_posting(doc_ids)
+    if dense:
+        bitmap_record = encode_bitmap_posting(doc_ids)
+        if len(bitmap_record) < len(record):
+            return bitmap_record
+    return record
+
+
+def max_record_size(df):
+    '''
+    upper bound of the size of an encoded record with df doc ids (doc ids are < 2 ** 32)
+    '''
+    return 5 * (df + 2)
+
+
+def decode_header(buffer, position = 0):
+    '''
+    returns (df, kind, start and length of the doc id stream)
+    '''
+    (header, length), position = vb_decode(buffer, position, 2)
+    return header >> KIND_BITS, header & ((1 << KIND_BITS) - 1), position, length
+
+
+def record_kind(buffer, position = 0):
+    (header,), position = vb_decode(buffer, position, 1)
+    return header & ((1 << KIND_BITS) - 1)
+
+
+def decode_bitmap(buffer, position = 0):
+    '''
+    decodes a bitmap record into (df, bytes in which bit doc_id % 8 of byte doc_id // 8 - start is set for every doc id,
+    start), the bytes beginning at the first container so that their size follows the range of the doc ids
+    rather than the largest one
+    '''
+    (header, count), position = vb_decode(buffer, position, 2)
+    containers = []
+    key = 0
+    for _ in range(count):
+        (key_gap, cardinality), position = vb_decode(buffer, position, 2)
+        key += key_gap
+        cardinality += 1
+        size = CONTAINER_BYTES if cardinality > ARRAY_CONTAINER_MAX else 2 * cardinality
+        containers.append((key, cardinality, position))
+        position += size
+    if not containers:
+        return header >> KIND_BITS, b"", 0
+    first_key = containers[0][0]
+    bitmap = bytearray((key + 1 - first_key) * CONTAINER_BYTES)
+    for key, cardinality, position in containers:
+        start = (key - first_key) * CONTAINER_BYTES
+        if cardinality > ARRAY_CONTAINER_MAX:
+            bitmap[start:start + CONTAINER_BYTES] = buffer[position:position + CONTAINER_BYTES]
+            continue
+        lows = array('H', bytes(buffer[position:position + 2 * cardinality]))
+        if sys.byteorder == 'big':
+            lows.byteswap()
+        for low in lows:
+            bitmap[start + (low >> 3)] |= 1 << (low & 7)
+    return header >> KIND_BITS, bytes(bitmap), first_key * CONTAINER_BYTES
+
+
+# positions of the set bits of every byte value
+BYTE_BITS = tuple(tuple(bit for bit in range(8) if byte >> bit & 1) for byte in range(256))
+
+
+def bitmap_doc_ids(bitmap, start = 0):
+    '''
+    the sorted doc ids of a bitmap, or of a slice of it that begins at byte start of the bitmap
+    '''
+    doc_ids = array('I')
+    for i, byte in enumerate(bitmap, start):
+        if byte:
+            base = i << 3
+            doc_ids.extend(base + bit for bit in BYTE_BITS[byte])
+    return doc_ids
+
+
+def decode_posting(buffer, position = 0):
+    '''
+    decodes a record into an array of doc ids
+    '''
+    if record_kind(buffer, position) == KIND_BITMAP:
+        df, bitmap, start = decode_bitmap(buffer, position)
+        return bitmap_doc_ids(bitmap, start)
+    df, kind, position, length = decode_header(buffer, position)
+    return array('I', accumulate(vb_decode_stream(buffer, position, length)))
+
+
+def encode_positions(doc_ids, positions):
+    '''
+    encodes the positions of a term in each of its documents as
+    df, skip count, entry stream length, skip table, then an entry per doc id:
+    (gap from the previous doc id, byte length of its positions, gap-encoded positions)
+    the byte length lets a reader jump over the positions of documents it does not need
+    each skip entry is (gap from the previous skip's doc id, gap from the previous skip's byte position):
+    the doc id before an entry and where that entry starts, so decoding can resume at any skip
+    '''
+    data = bytearray()
+    skips = []
+    distance = skip_distance(len(doc_ids))
+    previous = 0
+    for i, (doc_id, doc_positions) in enumerate(zip(doc_ids, positions)):
+        if distance and i % distance == 0 and i != 0:
+            skips.append((previous, len(data)))
+        vb_encode_number(doc_id - previous, data)
+        previous = doc_id
+        gaps = bytearray()
+        previous_position = 0
+        for position in doc_positions:
+            vb_encode_number(position - previous_position, gaps)
+            previous_position = position
+        vb_encode_number(len(gaps), data)
+        data.extend(gaps)
+
+    record = bytearray()
+    vb_encode_number(len(doc_ids), record)
+    vb_encode_number(len(skips), record)
+    vb_encode_number(len(data), record)
+    previous_doc_id = previous_position = 0
+    for doc_id, position in skips:
+        vb_encode_number(doc_id - previous_doc_id, record)
+        vb_encode_number(position - previous_position, record)
+        previous_doc_id, previous_position = doc_id, position
+    record.extend(data)
+    return bytes(record)
+
+
+def decode_positions(buffer, doc_ids = None, position = 0):
+    '''
+    decodes a positions record into a list of (doc id, array of positions)
+    with sorted doc_ids, only the entries of those doc ids are decoded: the skip table is followed to the last skip
+    before each of them and the positions of the documents in between are jumped over
+    '''
+    (df, skip_count, length), position = vb_decode(buffer, position, 3)
+    skip_values, position = vb_decode(buffer, position, 2 * skip_count)
+    skips = list(zip(accumulate(skip_values[0::2]), accumulate(skip_values[1::2])))
+    start = position
+    end = start + length
+    entries = []
+    doc_id = 0
+    if doc_ids is None:
+        while position < end:
+            (gap, size), position = vb_decode(buffer, position, 2)
+            doc_id += gap
+            entries.append((doc_id, array('I', accumulate(vb_decode_stream(buffer, position, size)))))
+            position += size
+        return entries
+
+    skip = 0
+    for target in doc_ids:
+        while skip < len(skips) and skips[skip][0] < target:
+            if start + skips[skip][1] > position:
+                doc_id, position = skips[skip][0], start + skips[skip][1]
+            skip += 1
+        while position < end:
+            (gap, size), entry_start = vb_decode(buffer, position, 2)
+            if doc_id + gap > target:
+                break
+            doc_id += gap
+            position = entry_start + size
+            if doc_id == target:
+                entries.append((doc_id, array('I', accumulate(vb_decode_stream(buffer, entry_start, size)))))
+                break
+    return entries
+
+
+def encode_frequencies(frequencies):
+    '''
+    encodes the frequencies of a term in each of its documents, in doc id order, as
+    largest frequency (for bounds on scores), count, stream length, then the variable byte encoded frequencies
+    '''
+    data = bytearray()
+    for frequency in frequencies:
+        vb_encode_number(frequency, data)
+    record = bytearray()
+    vb_encode_number(max(frequencies, default=0), record)
+    vb_encode_number(len(frequencies), record)
+    vb_encode_number(len(data), record)
+    record.extend(data)
+    return bytes(record)
+
+
+def decode_frequencies(buffer, position = 0):
+    '''
+    decodes a frequencies record into (largest frequency, sequence of frequencies)
+    '''
+    (max_frequency, count, length), position = vb_decode(buffer, position, 3)
+    return max_frequency, vb_decode_stream(buffer, position, length)
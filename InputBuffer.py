@@ -1,6 +1,14 @@
 import sys
+from collections import deque
 
-from SkipLinkedList import SkipLinkedList
+from PostingList import parse_posting
+
+
+def entry_size(entry):
+    '''
+    bytes held by a buffered [term, posting string] entry
+    '''
+    return sys.getsizeof(entry) + sys.getsizeof(entry[0]) + sys.getsizeof(entry[1])
 
 
 class InputBuffer:
@@ -10,7 +18,10 @@ class InputBuffer:
         '''
         self.buffer_size = buffer_size
         self.file = file
-        self.buffer = []
+        # buffered lines, already split into [term, posting string]
+        self.buffer = deque()
+        # bytes held by the buffered lines
+        self.size = 0
         self.eof = False  # Flag to indicate end of file
         self.fill_buffer()
 
@@ -18,29 +29,38 @@ class InputBuffer:
         """
         Fill the buffer by reading lines from the file until the buffer is full or EOF is reached.
         """
-        while sys.getsizeof(self.buffer) < self.buffer_size:
+        while self.size < self.buffer_size:
             line = self.file.readline()
             if not line:
                 self.eof = True
                 break
-            self.buffer.append(line)
+            entry = line.split(" ", 1)
+            self.buffer.append(entry)
+            self.size += entry_size(entry)
 
     def pop_next_posting(self):
         """
         get next posting from buffer, and refill if empty
+        returns None when the file is exhausted
         """
-        term = None
-        posting = None
         if not self.buffer:
             self.fill_buffer()
-            if not self.eof:
+            if not self.buffer:
                 return None
-        term, posting = self.buffer.pop(0).split(" ", 1)
-        return term, SkipLinkedList(posting)
+        entry = self.buffer.popleft()
+        self.size -= entry_size(entry)
+        term, posting = entry
+        return term, parse_posting(posting)
 
     def peek_next_term(self):
+        '''
+        returns the term of the next posting without parsing it, refilling if empty
+        returns None when the file is exhausted
+        '''
+        if not self.buffer and not self.eof:
+            self.fill_buffer()
         if self.buffer:
-            return self.buffer[0].split(" ", 1)[0]
+            return self.buffer[0][0]
         else:
             return None
 
@@ -0,0 +1,109 @@
+import os
+import pickle
+import re
+from array import array
+
+from PostingList import PostingList
+from TermDictionary import TermDictionary
+
+# terms are indexed by their k-grams, with $ marking the start and the end of a term
+KGRAM_SIZE = 3
+
+# matches any (possibly empty) sequence of characters in a query term
+WILDCARD = '*'
+
+
+def kgram_index_path(dict_path):
+    '''
+    the k-gram index of a dictionary is kept next to it
+    '''
+    return dict_path + ".kgrams"
+
+
+def is_wildcard(term):
+    return WILDCARD in term
+
+
+def kgrams(text, k):
+    return [text[i:i + k] for i in range(len(text) - k + 1)]
+
+
+def pattern_kgrams(pattern, k):
+    '''
+    k-grams that every term matching a wildcard pattern contains: those of the pieces of $pattern$ between wildcards
+    '''
+    grams = set()
+    for piece in f"${pattern}$".split(WILDCARD):
+        grams.update(kgrams(piece, k))
+    return grams
+
+
+def pattern_regex(pattern):
+    return re.compile(".*".join(map(re.escape, pattern.split(WILDCARD))), re.DOTALL)
+
+
+def write_kgram_index(path, terms, k = KGRAM_SIZE):
+    '''
+    writes the k-gram index of terms given in the order of the term dictionary
+    every k-gram maps to the sorted positions of the terms containing it, so the candidate terms of a pattern
+    are an intersection of position lists
+    '''
+    grams = {}
+    for position, term in enumerate(terms):
+        # deduplicated in order rather than through a set, so the file does not depend on the hash seed
+        for gram in dict.fromkeys(kgrams(f"${term}$", k)):
+            grams.setdefault(gram, array('I')).append(position)
+    with open(path + ".tmp", 'wb') as f:
+        pickle.dump((k, {gram: positions.tobytes() for gram, positions in grams.items()}), f,
+                    protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(path + ".tmp", path)
+
+
+def load_kgram_index(path):
+    '''
+    the k-gram index at path, or None for indexes built without one
+    '''
+    return KGramIndex(path) if os.path.exists(path) else None
+
+
+class KGramIndex:
+    '''
+    k-gram index over the terms of a TermDictionary, read when the dictionary is opened
+    so that it does not change under a reader once the index is updated
+    '''
+    def __init__(self, path):
+        self.path = path
+        with open(path, 'rb') as f:
+            self.k, self.grams = pickle.load(f)
+
+    def positions(self, gram):
+        positions = array('I')
+        positions.frombytes(self.grams.get(gram, b""))
+        return PostingList(positions)
+
+    def candidates(self, pattern):
+        '''
+        positions of the terms containing every k-gram of a pattern, or None if the pattern has no k-gram
+        (e.g. a single letter before the wildcard), in which case every term is a candidate
+        '''
+        grams = pattern_kgrams(pattern, self.k)
+        if not grams:
+            return None
+        return PostingList.AND_all([self.positions(gram) for gram in grams]).doc_ids
+
+
+def expand_wildcard(pattern, dictionary, kgram_index = None):
+    '''
+    sorted terms of a dictionary matching a wildcard pattern
+    candidates come from the k-gram index if there is one, and are checked against the pattern
+    since having its k-grams is not enough (red has the k-grams of re*ed)
+    k-gram positions index the sorted terms of a TermDictionary, so an older pickled dictionary is scanned instead
+    '''
+    regex = pattern_regex(pattern)
+    use_kgrams = kgram_index is not None and isinstance(dictionary, TermDictionary)
+    candidates = kgram_index.candidates(pattern) if use_kgrams else None
+    if candidates is None:
+        terms = iter(dictionary)
+    else:
+        terms = (dictionary.term(position) for position in candidates)
+    return sorted(term for term in terms if regex.fullmatch(term))
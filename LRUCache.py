@@ -0,0 +1,80 @@
+import threading
+from collections import OrderedDict
+
+
+class LRUCache:
+    '''
+    least recently used cache bounded by a budget, where each value costs sizeof(value)
+    (by default every value costs 1, bounding the number of entries)
+    keeps hit, miss and eviction counters for sizing the budget
+    '''
+    def __init__(self, budget, sizeof = None):
+        self.budget = budget
+        self.sizeof = sizeof if sizeof else lambda value: 1
+        self.entries = OrderedDict()
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        '''
+        returns the cached value for key, or None if it is not cached
+        '''
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def put(self, key, value):
+        '''
+        caches value under key, evicting the least recently used values until it fits
+        values larger than the whole budget are not cached
+        '''
+        size = self.sizeof(value)
+        if size > self.budget:
+            return
+        with self.lock:
+            if key in self.entries:
+                self.size -= self.entries.pop(key)[1]
+            while self.entries and self.size + size > self.budget:
+                _, (_, evicted_size) = self.entries.popitem(last=False)
+                self.size -= evicted_size
+                self.evictions += 1
+            self.entries[key] = (value, size)
+            self.size += size
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.size = 0
+
+    def hit_rate(self):
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups else 0.0
+
+    def stats(self):
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'hit_rate': self.hit_rate(),
+            'entries': len(self.entries),
+            'size': self.size,
+            'budget': self.budget,
+        }
+
+    def __contains__(self, key):
+        return key in self.entries
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __str__(self):
+        return (f"hits={self.hits} misses={self.misses} evictions={self.evictions} "
+                f"hit rate={self.hit_rate():.1%} entries={len(self.entries)} size={self.size}/{self.budget}")
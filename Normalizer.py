@@ -0,0 +1,111 @@
+import os
+import pickle
+import time
+
+from nltk.stem import PorterStemmer
+
+from LRUCache import LRUCache
+
+
+class Normalizer:
+    '''
+    normalizes words into terms (stemmed, lowercased) through a bounded memo cache
+    shared by the indexer and the query parser so both always produce the same terms
+    '''
+    def __init__(self, ps = None, max_size = 500000):
+        self.ps = ps if ps else PorterStemmer()
+        self.cache = LRUCache(max_size)
+        self.stem_time = 0.0
+        # the first call of a stemmer warms it up and is much slower than the others, so the time of the first
+        # miss of every normalizer (one per worker process) is left out of the average cost of a miss
+        self.stemmed = False
+        self.warmups = 0
+        self.warmup_time = 0.0
+        # entries and counters since the last pop_updates(), for sending back from worker processes
+        self.record_updates = False
+        self.new_entries = {}
+        self.new_hits = 0
+        self.new_stem_time = 0.0
+        self.new_warmups = 0
+        self.new_warmup_time = 0.0
+
+    def normalize(self, word):
+        term = self.cache.get(word)
+        if term is None:
+            start = time.perf_counter()
+            term = self.ps.stem(word).lower()
+            elapsed = time.perf_counter() - start
+            self.stem_time += elapsed
+            self.new_stem_time += elapsed
+            if not self.stemmed:
+                self.stemmed = True
+                self.warmups += 1
+                self.warmup_time += elapsed
+                self.new_warmups += 1
+                self.new_warmup_time += elapsed
+            self.cache.put(word, term)
+            if self.record_updates:
+                self.new_entries[word] = term
+        else:
+            self.new_hits += 1
+        return term
+
+    def pop_updates(self):
+        '''
+        returns the entries and counters collected since the last call
+        '''
+        updates = (self.new_entries, self.new_hits, self.new_stem_time, self.new_warmups, self.new_warmup_time)
+        self.new_entries = {}
+        self.new_hits = 0
+        self.new_stem_time = 0.0
+        self.new_warmups = 0
+        self.new_warmup_time = 0.0
+        return updates
+
+    def apply_updates(self, updates):
+        '''
+        merges updates popped from another normalizer (e.g. in a worker process) into this one
+        '''
+        entries, hits, stem_time, warmups, warmup_time = updates
+        for word, term in entries.items():
+            if word not in self.cache:
+                self.cache.put(word, term)
+        self.cache.hits += hits
+        self.cache.misses += len(entries)
+        self.stem_time += stem_time
+        self.warmups += warmups
+        self.warmup_time += warmup_time
+
+    def time_saved(self):
+        '''
+        estimated stemming time saved by cache hits, from the average time of a cache miss after warmup
+        '''
+        misses = self.cache.misses - self.warmups
+        if misses <= 0:
+            return 0.0
+        return (self.stem_time - self.warmup_time) / misses * self.cache.hits
+
+    def save(self, path):
+        with open(path, 'wb') as f:
+            pickle.dump(dict((word, entry[0]) for word, entry in self.cache.entries.items()), f,
+                        protocol=pickle.HIGHEST_PROTOCOL)
+
+    def load(self, path):
+        '''
+        warms the cache from a file written by save(), if it exists
+        '''
+        if not os.path.exists(path):
+            return
+        with open(path, 'rb') as f:
+            for word, term in pickle.load(f).items():
+                self.cache.put(word, term)
+
+    def __str__(self):
+        return f"{self.cache}, stemming time {self.stem_time:.2f}s, saved ~{self.time_saved():.2f}s"
+
+
+def stem_cache_path(dict_path):
+    '''
+    the persisted stemming cache is kept next to the dictionary
+    '''
+    return dict_path + ".stems"
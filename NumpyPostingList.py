@@ -0,0 +1,101 @@
+import sys
+
+import numpy as np
+
+from PostingList import BitmapPostingList, ComplementPostingList, PostingList, choose_intersection
+
+
+class NumpyPostingList(PostingList):
+    '''
+    posting list backed by a sorted numpy array of unique doc ids, for the numpy evaluation engine of QueryParser
+    intersections, unions and differences are vectorized sorted-array routines instead of Python loops
+    '''
+    def __init__(self, values = None):
+        self.has_skips = False
+        self.values = values if values is not None else np.empty(0, dtype=np.uint32)
+
+    @classmethod
+    def from_posting(cls, posting):
+        '''
+        converts any posting list: arrays of doc ids are shared without copying and bitmaps are unpacked at once
+        '''
+        if isinstance(posting, NumpyPostingList):
+            return posting
+        if isinstance(posting, BitmapPostingList):
+            bits = np.unpackbits(np.frombuffer(posting.bitmap, dtype=np.uint8), bitorder='little')
+            return cls((np.flatnonzero(bits) + (posting.start << 3)).astype(np.uint32))
+        if isinstance(posting, ComplementPostingList):
+            return cls(np.asarray(posting.doc_ids, dtype=np.uint32))
+        return cls(np.frombuffer(posting.doc_ids, dtype=np.uint32))
+
+    @property
+    def doc_ids(self):
+        return self.values
+
+    @property
+    def length(self):
+        return len(self.values)
+
+    def OR(self, other_posting_list):
+        if isinstance(other_posting_list, ComplementPostingList):
+            return other_posting_list.OR(self)
+        other = NumpyPostingList.from_posting(other_posting_list).values
+        return NumpyPostingList(np.union1d(self.values, other))
+
+    def AND(self, other_posting_list, algorithm = None):
+        '''
+        'gallop' looks up the doc ids of the shorter array in the longer one with a binary search each,
+        any other algorithm merges the two arrays
+        '''
+        if isinstance(other_posting_list, ComplementPostingList):
+            return other_posting_list.AND(self)
+        values = self.values
+        other = NumpyPostingList.from_posting(other_posting_list).values
+        if algorithm is None:
+            algorithm = choose_intersection(len(values), len(other))
+        if algorithm != 'gallop':
+            return NumpyPostingList(np.intersect1d(values, other, assume_unique=True))
+        if len(values) > len(other):
+            values, other = other, values
+        if not len(values):
+            return NumpyPostingList(values)
+        positions = np.searchsorted(other, values)
+        found = positions < len(other)
+        found[found] = other[positions[found]] == values[found]
+        return NumpyPostingList(values[found])
+
+    @staticmethod
+    def OR_all(posting_lists):
+        '''
+        union of any number of posting lists with one sort of all their doc ids
+        '''
+        complements = [posting_list for posting_list in posting_lists if isinstance(posting_list, ComplementPostingList)]
+        values = [NumpyPostingList.from_posting(posting_list).values for posting_list in posting_lists
+                  if not isinstance(posting_list, ComplementPostingList)]
+        result = NumpyPostingList(np.unique(np.concatenate(values)) if values else None)
+        for complement in complements:
+            result = complement.OR(result)
+        return result
+
+    def NOT(self, other_posting_list):
+        if isinstance(other_posting_list, ComplementPostingList):
+            # A - NOT B = A AND B
+            return self.AND(other_posting_list.excluded)
+        other = NumpyPostingList.from_posting(other_posting_list).values
+        return NumpyPostingList(np.setdiff1d(self.values, other, assume_unique=True))
+
+    def memory_size(self):
+        return sys.getsizeof(self) + self.values.nbytes
+
+    def get_value_string(self):
+        return " ".join(map(str, self.values.tolist()))
+
+    def iter_chunks(self, chunk_size):
+        for start in range(0, len(self.values), chunk_size):
+            yield self.values[start:start + chunk_size].tolist()
+
+    def __iter__(self):
+        return iter(self.values.tolist())
+
+    def __len__(self):
+        return self.length
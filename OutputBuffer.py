@@ -1,11 +1,20 @@
 import sys
 
 
+def entry_size(posting):
+    '''
+    bytes held by a buffered (term, PostingList) entry
+    '''
+    return sys.getsizeof(posting) + sys.getsizeof(posting[0]) + posting[1].memory_size()
+
+
 class OutputBuffer:
     def __init__(self, file, buffer_size):
         self.buffer_size = buffer_size
         self.file_object = file
         self.buffer = []
+        # bytes held by the buffered postings
+        self.size = 0
 
     def insert(self, posting):
         """
@@ -15,11 +24,14 @@ class OutputBuffer:
         """
 
         if self.buffer and self.buffer[-1][0] == posting[0]:
+            self.size -= entry_size(self.buffer[-1])
             self.buffer[-1] = (self.buffer[-1][0], self.buffer[-1][1].merge(posting[1]))
+            self.size += entry_size(self.buffer[-1])
         else:
             self.buffer.append(posting)
+            self.size += entry_size(posting)
 
-        if sys.getsizeof(self.buffer) >= self.buffer_size:
+        if self.size >= self.buffer_size:
             self.flush()
 
     def flush(self):
@@ -30,6 +42,7 @@ class OutputBuffer:
             strings = [f"{term} {doc_ids}\n" for term, doc_ids in self.buffer]
             self.file_object.writelines(strings)
             self.buffer.clear()
+            self.size = 0
 
     def close(self):
         """
@@ -0,0 +1,188 @@
+import mmap
+import os
+import pickle
+import struct
+import sys
+from array import array
+
+from Compression import decode_frequencies, decode_positions
+
+# positions and term frequency files start with these lines
+MAGIC = b"VBPOSITIONS1\n"
+FREQUENCIES_MAGIC = b"VBFREQUENCIES1\n"
+
+# number of records, then the offset of the table of record offsets (after the magic line)
+HEADER = struct.Struct('<QQ')
+OFFSET = struct.Struct('<Q')
+
+
+def is_phrase(term):
+    return term.startswith('"')
+
+
+def phrase_terms(phrase):
+    return phrase.strip('"').split()
+
+
+def positions_path(postings_path):
+    '''
+    the positions of a positional index are kept next to its postings
+    '''
+    return postings_path + ".positions"
+
+
+def frequencies_path(postings_path):
+    '''
+    the term frequencies of a positional index, counted from its positions
+    '''
+    return postings_path + ".tf"
+
+
+def document_lengths_path(postings_path):
+    return postings_path + ".lengths"
+
+
+def write_document_lengths(path, lengths):
+    '''
+    pickles the dictionary of doc id -> number of tokens of the documents of an index
+    '''
+    with open(path, 'wb') as f:
+        pickle.dump(lengths, f, protocol=pickle.HIGHEST_PROTOCOL)
+
+
+def load_document_lengths(path):
+    '''
+    the dictionary of doc id -> number of tokens at path, empty for indexes built without positions
+    '''
+    if not os.path.exists(path):
+        return {}
+    with open(path, 'rb') as f:
+        return pickle.load(f)
+
+
+def load_positional_index(path, dictionary):
+    '''
+    the positions at path, or None for indexes built without positions
+    '''
+    return PositionalIndex(path, dictionary) if os.path.exists(path) else None
+
+
+def load_term_frequencies(path, dictionary):
+    '''
+    the term frequencies at path, or None for indexes built without them
+    '''
+    return TermFrequencies(path, dictionary) if os.path.exists(path) else None
+
+
+class RecordsWriter:
+    '''
+    writes a record for every term of a term dictionary in its order, followed by the table of their offsets
+    the file is written next to the old one and swapped in when closed
+    '''
+    def __init__(self, path, magic = MAGIC):
+        self.path = path
+        self.magic = magic
+        self.file = open(path + ".tmp", 'wb')
+        self.file.write(magic)
+        self.file.write(HEADER.pack(0, 0))
+        self.offsets = array('Q')
+
+    def write(self, record):
+        self.offsets.append(self.file.tell())
+        self.file.write(record)
+
+    def close(self):
+        table_offset = self.file.tell()
+        self.offsets.append(table_offset)
+        if sys.byteorder == 'big':
+            self.offsets.byteswap()
+        self.file.write(self.offsets.tobytes())
+        self.file.seek(len(self.magic))
+        self.file.write(HEADER.pack(len(self.offsets) - 1, table_offset))
+        self.file.close()
+        os.replace(self.path + ".tmp", self.path)
+
+
+class TermRecords:
+    '''
+    memory-mapped records of the terms of a dictionary, found through the index of a term in its sorted terms
+    a TermDictionary finds that index in place; for an older pickled dictionary the indexes are computed once here
+    '''
+    magic = MAGIC
+
+    def __init__(self, path, dictionary):
+        self.file = open(path, 'rb')
+        self.buffer = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+        self.count, self.table_offset = HEADER.unpack_from(self.buffer, len(self.magic))
+        self.dictionary = dictionary
+        self.indexes = None if hasattr(dictionary, 'find') else {term: i for i, term in enumerate(sorted(dictionary))}
+
+    def record_bounds(self, term):
+        '''
+        start and end of the record of a term, or None if the term is not in the dictionary
+        '''
+        index = self.dictionary.find(term) if self.indexes is None else self.indexes.get(term, -1)
+        if index == -1:
+            return None
+        position = self.table_offset + OFFSET.size * index
+        return OFFSET.unpack_from(self.buffer, position)[0], OFFSET.unpack_from(self.buffer, position + OFFSET.size)[0]
+
+    def record(self, term):
+        bounds = self.record_bounds(term)
+        return self.buffer[bounds[0]:bounds[1]] if bounds else None
+
+    def close(self):
+        self.buffer.close()
+        self.file.close()
+
+
+class PositionalIndex(TermRecords):
+    '''
+    positions of each term in each of its documents (see encode_positions)
+    '''
+    def get_positions(self, term, doc_ids = None):
+        '''
+        (doc id, array of positions) of a term in each of the sorted doc_ids that contain it (all of them if None)
+        '''
+        bounds = self.record_bounds(term)
+        if bounds is None:
+            return []
+        return decode_positions(self.buffer, doc_ids, bounds[0])
+
+
+class TermFrequencies(TermRecords):
+    '''
+    frequency of each term in each of its documents, in the order of its posting (see encode_frequencies)
+    '''
+    magic = FREQUENCIES_MAGIC
+
+    def get_frequencies(self, term):
+        '''
+        (largest frequency, frequencies in the order of the doc ids of the posting) of a term
+        '''
+        bounds = self.record_bounds(term)
+        if bounds is None:
+            return 0, []
+        return decode_frequencies(self.buffer, bounds[0])
+
+
+def phrase_intersection(phrase, doc_ids, get_positions):
+    '''
+    the doc ids among doc_ids (documents containing every term of the phrase) in which the terms occur consecutively
+    phrase is a list of (offset in the phrase, term) in the order to check them, best rarest first:
+    only the documents still matching after a term are looked up for the next one, so the positions
+    of every other document are skipped over
+    '''
+    (offset, term), rest = phrase[0], phrase[1:]
+    # possible start positions of the phrase in each document
+    starts = {doc_id: {position - offset for position in positions} for doc_id, positions in get_positions(term, doc_ids)}
+    for offset, term in rest:
+        if not starts:
+            break
+        matches = {}
+        for doc_id, positions in get_positions(term, list(starts)):
+            doc_starts = starts[doc_id].intersection(position - offset for position in positions)
+            if doc_starts:
+                matches[doc_id] = doc_starts
+        starts = matches
+    return array('I', starts)
@@ -0,0 +1,646 @@
+import math
+import sys
+import threading
+from array import array
+from bisect import bisect_left, bisect_right
+
+from Compression import bitmap_doc_ids
+
+INTERSECTION_ALGORITHMS = ('merge', 'skip', 'gallop')
+
+
+def merge_intersection(list1, list2):
+    '''
+    linear merge of two sorted arrays of doc ids
+    '''
+    len1 = len(list1)
+    len2 = len(list2)
+    intersection = array('I')
+    i = j = 0
+    while i < len1 and j < len2:
+        val1 = list1[i]
+        val2 = list2[j]
+        if val1 == val2:
+            intersection.append(val1)
+            i += 1
+            j += 1
+        elif val1 < val2:
+            i += 1
+        else:
+            j += 1
+    return intersection
+
+
+def skip_intersection(list1, skip1, list2, skip2):
+    '''
+    merge of two sorted arrays of doc ids that follows the implicit skip pointers every skip1 (skip2) entries
+    '''
+    len1 = len(list1)
+    len2 = len(list2)
+    intersection = array('I')
+    i = j = 0
+
+    while i < len1 and j < len2:
+        val1 = list1[i]
+        val2 = list2[j]
+        if val1 == val2:
+            intersection.append(val1)
+            i += 1
+            j += 1
+        elif val1 < val2:
+            if skip1 and i % skip1 == 0 and i + skip1 < len1 and list1[i + skip1] <= val2:
+                i += skip1
+            else:
+                i += 1
+        else:
+            if skip2 and j % skip2 == 0 and j + skip2 < len2 and list2[j + skip2] <= val1:
+                j += skip2
+            else:
+                j += 1
+
+    return intersection
+
+
+def gallop(doc_ids, val, start):
+    '''
+    index of the first doc id >= val at or after start,
+    found with an exponential search from start followed by a binary search
+    '''
+    length = len(doc_ids)
+    step = 1
+    while start + step < length and doc_ids[start + step] < val:
+        step *= 2
+    return bisect_left(doc_ids, val, start + step // 2, min(start + step + 1, length))
+
+
+def gallop_intersection(list1, list2):
+    '''
+    looks up every doc id of the shorter array in the longer one by galloping from the last match
+    '''
+    if len(list1) > len(list2):
+        list1, list2 = list2, list1
+    len2 = len(list2)
+    intersection = array('I')
+    j = 0
+    for val in list1:
+        j = gallop(list2, val, j)
+        if j == len2:
+            break
+        if list2[j] == val:
+            intersection.append(val)
+            j += 1
+    return intersection
+
+
+def intersection_cost(algorithm, length1, length2):
+    '''
+    rough cost of intersecting lists of these lengths with an algorithm, in steps of the merge loop
+    '''
+    short, long = sorted((length1, length2))
+    if not short:
+        return 0
+    if algorithm == 'merge':
+        return short + long
+    if algorithm == 'skip':
+        # a skip passes sqrt(long) entries of the long list, but costs more than a merge step
+        distance = max(1.0, math.sqrt(long))
+        return 1.5 * (short + min(long, long / distance + short * distance / 2))
+    # an exponential and a binary search for every entry of the short list
+    return short * (2 + 2 * math.log2(long / short + 1))
+
+
+def choose_intersection(length1, length2):
+    '''
+    the cheapest intersection algorithm for lists of these lengths
+    '''
+    return min(INTERSECTION_ALGORITHMS, key=lambda algorithm: intersection_cost(algorithm, length1, length2))
+
+
+class PostingList:
+    '''
+    compact posting list of sorted doc ids backed by a single array('I')
+    skip pointers are implicit: every skip_distance-th index skips skip_distance entries ahead
+    reads and writes the same "12^40 17 23" save string format as SkipLinkedList
+    '''
+    def __init__(self, save_string = None):
+        # Either initializes from nothing, from a save string, from a list of ints or from an array
+        self.has_skips = False
+        if isinstance(save_string, array):
+            self.doc_ids = save_string
+        elif isinstance(save_string, list):
+            self.from_list(save_string)
+        elif not save_string:
+            self.doc_ids = array('I')
+        else:
+            self.from_string(save_string)
+
+    def from_string(self, s):
+        '''
+        parses a save string; skip targets are not stored as they are recomputed from the length
+        '''
+        doc_ids = s.split()
+        self.has_skips = any('^' in doc_id for doc_id in doc_ids)
+        if self.has_skips:
+            doc_ids = [doc_id.split('^', 1)[0] for doc_id in doc_ids]
+        self.doc_ids = array('I', map(int, doc_ids))
+
+    def from_list(self, save_list):
+        self.doc_ids = array('I', save_list)
+        self.update_skip_pointers()
+
+    @property
+    def length(self):
+        return len(self.doc_ids)
+
+    @property
+    def skip_distance(self):
+        '''
+        distance between skip positions, same as SkipLinkedList (0 when the list is too short for skips)
+        '''
+        if len(self.doc_ids) <= 3:
+            return 0
+        return round(math.sqrt(len(self.doc_ids)))
+
+    def update_skip_pointers(self):
+        '''
+        skips are implicit, so this only marks the list as carrying skips when saved
+        '''
+        self.has_skips = True
+
+    def skip_targets(self):
+        '''
+        returns a dictionary of index -> skip target index
+        '''
+        distance = self.skip_distance
+        if not distance:
+            return {}
+        return {i: i + distance for i in range(0, len(self.doc_ids) - distance, distance)}
+
+    def merge(self, other_posting_list):
+        '''
+        union of two lists, with skip pointers added
+        '''
+        merged_list = self.OR(other_posting_list)
+        merged_list.update_skip_pointers()
+        return merged_list
+
+    def OR(self, other_posting_list):
+        '''
+        does an OR operation between self and other list
+        returns a merge of the two lists
+        '''
+        if isinstance(other_posting_list, (ComplementPostingList, BitmapPostingList)):
+            return other_posting_list.OR(self)
+        list1 = self.doc_ids
+        list2 = other_posting_list.doc_ids
+        if not list1:
+            return PostingList(array('I', list2))
+        if not list2:
+            return PostingList(array('I', list1))
+        # disjoint ranges (e.g. consecutive blocks during indexing) are a plain concatenation
+        if list1[-1] < list2[0]:
+            return PostingList(list1 + list2)
+        if list2[-1] < list1[0]:
+            return PostingList(list2 + list1)
+        return PostingList(array('I', sorted(set(list1).union(list2))))
+
+    def AND(self, other_posting_list, algorithm = None):
+        """
+        performs AND operation between self and other list
+        with a linear 'merge', using the implicit skip pointers ('skip') or by galloping through the longer list ('gallop')
+        without an algorithm, the cheapest one for the ratio of the list lengths is used
+        returns the intersection of two lists
+        """
+        if isinstance(other_posting_list, (ComplementPostingList, BitmapPostingList)):
+            return other_posting_list.AND(self)
+        if algorithm is None:
+            algorithm = choose_intersection(self.length, other_posting_list.length)
+        if algorithm == 'merge':
+            return PostingList(merge_intersection(self.doc_ids, other_posting_list.doc_ids))
+        if algorithm == 'gallop':
+            return PostingList(gallop_intersection(self.doc_ids, other_posting_list.doc_ids))
+        return PostingList(skip_intersection(self.doc_ids, self.skip_distance,
+                                             other_posting_list.doc_ids, other_posting_list.skip_distance))
+
+    @staticmethod
+    def AND_all(posting_lists, algorithms = None):
+        """
+        intersection of any number of posting lists at once
+        without algorithms, the lists are intersected from the shortest up with the cheapest algorithm for each pair;
+        otherwise in the given order, algorithms[i] intersecting posting_lists[i + 1] into the result so far
+        stops as soon as the intersection is empty
+        """
+        if algorithms is None:
+            posting_lists = sorted(posting_lists, key=lambda posting_list: posting_list.length)
+            algorithms = [None] * (len(posting_lists) - 1)
+        result = posting_lists[0]
+        for posting_list, algorithm in zip(posting_lists[1:], algorithms):
+            if not result.length:
+                break
+            result = result.AND(posting_list, algorithm)
+        return result
+
+    @staticmethod
+    def OR_all(posting_lists):
+        """
+        union of any number of posting lists at once, instead of one union per pair that copies the result so far:
+        the doc ids of all arrays are collected in one set and sorted once, and all bitmaps are ORed together
+        """
+        bitmaps = [posting_list for posting_list in posting_lists if isinstance(posting_list, BitmapPostingList)]
+        complements = [posting_list for posting_list in posting_lists if isinstance(posting_list, ComplementPostingList)]
+        doc_ids = set()
+        for posting_list in posting_lists:
+            if not isinstance(posting_list, (BitmapPostingList, ComplementPostingList)):
+                doc_ids.update(posting_list.doc_ids)
+        result = PostingList(array('I', sorted(doc_ids)))
+        if bitmaps:
+            start = min(bitmap.start for bitmap in bitmaps)
+            bits = 0
+            for bitmap in bitmaps:
+                bits |= bitmap.to_int(start)
+            bitmap = BitmapPostingList.from_int(bits, start)
+            result = bitmap.OR(result) if result.length else bitmap
+        for complement in complements:
+            result = complement.OR(result)
+        return result
+
+    def NOT(self, other_posting_list):
+        """
+        performs a NOT operation where self is assumed to be the superset
+        returns a list of values in self but not in other list
+        """
+        if isinstance(other_posting_list, ComplementPostingList):
+            # A - NOT B = A AND B
+            return self.AND(other_posting_list.excluded)
+        if isinstance(other_posting_list, BitmapPostingList):
+            return PostingList(other_posting_list.select(self.doc_ids, False))
+        if not other_posting_list.doc_ids:
+            return PostingList(array('I', self.doc_ids))
+        excluded = set(other_posting_list.doc_ids)
+        return PostingList(array('I', [doc_id for doc_id in self.doc_ids if doc_id not in excluded]))
+
+    def memory_size(self):
+        '''
+        bytes held by this posting list and its array of doc ids
+        '''
+        return sys.getsizeof(self) + sys.getsizeof(self.doc_ids)
+
+    def get_value_string(self):
+        '''
+        only values (no pointers)
+        '''
+        return " ".join(map(str, self.doc_ids))
+
+    def iter_chunks(self, chunk_size):
+        '''
+        yields the doc ids in order, in chunks of at most chunk_size
+        '''
+        doc_ids = self.doc_ids
+        for start in range(0, len(doc_ids), chunk_size):
+            yield doc_ids[start:start + chunk_size]
+
+    def iter_value_strings(self, chunk_size = 65536):
+        '''
+        the value string in pieces of at most chunk_size doc ids, so a huge result is never built as one string
+        '''
+        separator = ""
+        for chunk in self.iter_chunks(chunk_size):
+            if len(chunk):
+                yield separator + " ".join(map(str, chunk))
+                separator = " "
+
+    def head(self, k):
+        '''
+        the first k doc ids, reading only as many chunks as needed
+        '''
+        doc_ids = array('I')
+        if k <= 0:
+            return PostingList(doc_ids)
+        for chunk in self.iter_chunks(k):
+            doc_ids.extend(chunk[:k - len(doc_ids)])
+            if len(doc_ids) >= k:
+                break
+        return PostingList(doc_ids)
+
+    def __len__(self):
+        return len(self.doc_ids)
+
+    def __iter__(self):
+        return iter(self.doc_ids)
+
+    def __str__(self):
+        if not self.has_skips:
+            return self.get_value_string()
+        skips = self.skip_targets()
+        doc_ids = self.doc_ids
+        return " ".join(f"{doc_id}^{doc_ids[skips[i]]}" if i in skips else str(doc_id)
+                        for i, doc_id in enumerate(doc_ids))
+
+    def __repr__(self):
+        return str(self)
+
+
+class LazyPostingList(PostingList):
+    '''
+    posting list over an undecoded slice of a postings buffer
+    the slice is only decoded into doc ids the first time they are needed
+    '''
+    def __init__(self, view, decode, df):
+        self.has_skips = False
+        self.view = view
+        self.decode = decode
+        self.df = df
+        self._doc_ids = None
+        self.lock = threading.Lock()
+
+    @property
+    def doc_ids(self):
+        if self._doc_ids is None:
+            with self.lock:
+                if self._doc_ids is None:
+                    self._doc_ids = self.decode(self.view)
+                    # release the view so the underlying buffer can be closed
+                    self.view.release()
+                    self.view = None
+        return self._doc_ids
+
+    @property
+    def length(self):
+        if self._doc_ids is None:
+            return self.df
+        return len(self._doc_ids)
+
+    def __len__(self):
+        return self.length
+
+
+class BitmapPostingList(PostingList):
+    '''
+    dense posting list kept as a bitmap, in which bit doc_id % 8 of byte doc_id // 8 - start is set for every doc id,
+    so that the bitmap only spans the range of its doc ids
+    operations with other bitmaps work a machine word at a time on the bitmaps as Python ints aligned on the smaller start,
+    and operations with arrays of doc ids test or set one bit per doc id of the array
+    the doc ids are only decoded when they are read
+    '''
+    def __init__(self, bitmap, df, start = 0):
+        self.has_skips = False
+        self.bitmap = bitmap
+        self.df = df
+        self.start = start
+        self._doc_ids = None
+        self.lock = threading.Lock()
+
+    @classmethod
+    def from_int(cls, bits, start = 0):
+        '''
+        bitmap of the bits of an int whose bit 0 is doc id start * 8, leaving out its leading zero bytes
+        '''
+        if bits:
+            zero_bytes = ((bits & -bits).bit_length() - 1) >> 3
+            bits >>= zero_bytes << 3
+            start += zero_bytes
+        return cls(bits.to_bytes((bits.bit_length() + 7) // 8, 'little'), bits.bit_count(), start)
+
+    def to_int(self, start = None):
+        '''
+        the bitmap as an int whose bit 0 is doc id start * 8, for a start at most that of the bitmap
+        '''
+        bits = int.from_bytes(self.bitmap, 'little')
+        if start is None:
+            return bits
+        return bits << ((self.start - start) << 3)
+
+    @staticmethod
+    def combine(bitmaps, operation):
+        '''
+        bitmap of an operation on the ints of bitmaps aligned on their smallest start
+        '''
+        start = min(bitmap.start for bitmap in bitmaps)
+        return BitmapPostingList.from_int(operation(*(bitmap.to_int(start) for bitmap in bitmaps)), start)
+
+    @property
+    def doc_ids(self):
+        if self._doc_ids is None:
+            with self.lock:
+                if self._doc_ids is None:
+                    self._doc_ids = bitmap_doc_ids(self.bitmap, self.start)
+        return self._doc_ids
+
+    @property
+    def length(self):
+        return self.df
+
+    def iter_chunks(self, chunk_size):
+        '''
+        decodes the bitmap a slice at a time, unless its doc ids are already decoded
+        chunks hold the doc ids of ranges of chunk_size doc ids, so at most chunk_size each
+        '''
+        if self._doc_ids is not None:
+            yield from super().iter_chunks(chunk_size)
+            return
+        step = max(1, chunk_size >> 3)
+        for start in range(0, len(self.bitmap), step):
+            yield bitmap_doc_ids(self.bitmap[start:start + step], self.start + start)
+
+    def select(self, doc_ids, present = True):
+        '''
+        the doc ids of an array that are (or with present False, are not) in this bitmap
+        '''
+        bitmap = self.bitmap
+        first = self.start << 3
+        end = first + (len(bitmap) << 3)
+        if present:
+            return array('I', [doc_id for doc_id in doc_ids
+                               if first <= doc_id < end and bitmap[(doc_id - first) >> 3] >> (doc_id & 7) & 1])
+        return array('I', [doc_id for doc_id in doc_ids
+                           if not first <= doc_id < end or not bitmap[(doc_id - first) >> 3] >> (doc_id & 7) & 1])
+
+    def update_bits(self, doc_ids, value):
+        '''
+        a copy of this bitmap with the bits of doc_ids set (or with value False, cleared)
+        '''
+        bitmap = bytearray(self.bitmap)
+        start = self.start
+        if value and doc_ids:
+            if doc_ids[0] >> 3 < start:
+                bitmap[:0] = bytes(start - (doc_ids[0] >> 3))
+                start = doc_ids[0] >> 3
+            if (doc_ids[-1] >> 3) - start >= len(bitmap):
+                bitmap.extend(bytes((doc_ids[-1] >> 3) - start + 1 - len(bitmap)))
+        df = self.df
+        for doc_id in doc_ids:
+            index = (doc_id >> 3) - start
+            if index < 0:
+                continue
+            if index >= len(bitmap):
+                break
+            bit = 1 << (doc_id & 7)
+            if bool(bitmap[index] & bit) != value:
+                bitmap[index] ^= bit
+                df += 1 if value else -1
+        return BitmapPostingList(bytes(bitmap), df, start)
+
+    def AND(self, other_posting_list, algorithm = None):
+        if isinstance(other_posting_list, ComplementPostingList):
+            return other_posting_list.AND(self)
+        if isinstance(other_posting_list, BitmapPostingList):
+            return BitmapPostingList.combine([self, other_posting_list], lambda a, b: a & b)
+        return PostingList(self.select(other_posting_list.doc_ids))
+
+    def OR(self, other_posting_list):
+        if isinstance(other_posting_list, ComplementPostingList):
+            return other_posting_list.OR(self)
+        if isinstance(other_posting_list, BitmapPostingList):
+            return BitmapPostingList.combine([self, other_posting_list], lambda a, b: a | b)
+        return self.update_bits(other_posting_list.doc_ids, True)
+
+    def NOT(self, other_posting_list):
+        if isinstance(other_posting_list, ComplementPostingList):
+            # A - NOT B = A AND B
+            return self.AND(other_posting_list.excluded)
+        if isinstance(other_posting_list, BitmapPostingList):
+            return BitmapPostingList.combine([self, other_posting_list], lambda a, b: a & ~b)
+        return self.update_bits(other_posting_list.doc_ids, False)
+
+    def memory_size(self):
+        return sys.getsizeof(self) + sys.getsizeof(self.bitmap)
+
+    def __len__(self):
+        return self.length
+
+
+class ComplementPostingList(PostingList):
+    '''
+    doc ids of the full list that are not in an excluded posting list, materialized only when its doc ids are read
+    combined with a posting list it becomes a difference (A AND NOT B = A - B),
+    and with another complement it stays a complement by De Morgan's laws
+    '''
+    def __init__(self, full_list, excluded):
+        self.has_skips = False
+        self.full_list = full_list
+        self.excluded = excluded
+        self._doc_ids = None
+        self.lock = threading.Lock()
+
+    @property
+    def doc_ids(self):
+        if self._doc_ids is None:
+            with self.lock:
+                if self._doc_ids is None:
+                    self._doc_ids = self.full_list.NOT(self.excluded).doc_ids
+        return self._doc_ids
+
+    def iter_chunks(self, chunk_size):
+        '''
+        walks the full list a chunk at a time, leaving out the excluded doc ids of each chunk,
+        so the complement is streamed without being materialized
+        '''
+        if self._doc_ids is not None:
+            yield from super().iter_chunks(chunk_size)
+            return
+        excluded = self.excluded.doc_ids
+        j = 0
+        for chunk in self.full_list.iter_chunks(chunk_size):
+            if not len(chunk):
+                continue
+            end = bisect_right(excluded, chunk[-1], j)
+            if end == j:
+                yield chunk
+                continue
+            skipped = set(excluded[j:end])
+            j = end
+            yield array('I', [doc_id for doc_id in chunk if doc_id not in skipped])
+
+    @property
+    def length(self):
+        # the excluded doc ids are always a subset of the full list
+        return self.full_list.length - self.excluded.length
+
+    def AND(self, other_posting_list, algorithm = None):
+        if isinstance(other_posting_list, ComplementPostingList):
+            # NOT A AND NOT B = NOT (A OR B)
+            return ComplementPostingList(self.full_list, self.excluded.OR(other_posting_list.excluded))
+        # B AND NOT A = B - A
+        return other_posting_list.NOT(self.excluded)
+
+    def OR(self, other_posting_list):
+        if isinstance(other_posting_list, ComplementPostingList):
+            # NOT A OR NOT B = NOT (A AND B)
+            return ComplementPostingList(self.full_list, self.excluded.AND(other_posting_list.excluded))
+        # B OR NOT A = NOT (A - B)
+        return ComplementPostingList(self.full_list, self.excluded.NOT(other_posting_list))
+
+    def NOT(self, other_posting_list):
+        if isinstance(other_posting_list, ComplementPostingList):
+            # NOT A - NOT B = B - A
+            return other_posting_list.excluded.NOT(self.excluded)
+        # NOT A - B = NOT (A OR B)
+        return ComplementPostingList(self.full_list, self.excluded.OR(other_posting_list))
+
+    def memory_size(self):
+        return sys.getsizeof(self) + self.excluded.memory_size()
+
+    def __len__(self):
+        return self.length
+
+
+class PositionalPostingList(PostingList):
+    '''
+    posting list that also holds the sorted positions of its term in each document, for positional indexes
+    positions[i] are the positions in doc_ids[i]; its save string is "3:0,14 7:5", without skips
+    '''
+    def __init__(self, save_string = None, positions = None):
+        self.has_skips = False
+        if isinstance(save_string, array):
+            self.doc_ids = save_string
+            self.positions = positions
+        elif not save_string:
+            self.doc_ids = array('I')
+            self.positions = []
+        else:
+            self.from_string(save_string)
+
+    def from_string(self, s):
+        self.doc_ids = array('I')
+        self.positions = []
+        for entry in s.split():
+            doc_id, positions = entry.split(':', 1)
+            self.doc_ids.append(int(doc_id))
+            self.positions.append(array('I', map(int, positions.split(','))))
+
+    def update_skip_pointers(self):
+        pass
+
+    def OR(self, other_posting_list):
+        '''
+        union by doc id, combining the positions of a doc id in both lists
+        '''
+        list1, list2 = self.doc_ids, other_posting_list.doc_ids
+        # disjoint ranges (e.g. consecutive blocks during indexing) are a plain concatenation
+        if not list2 or (list1 and list1[-1] < list2[0]):
+            return PositionalPostingList(list1 + list2, self.positions + other_posting_list.positions)
+        if not list1 or list2[-1] < list1[0]:
+            return PositionalPostingList(list2 + list1, other_posting_list.positions + self.positions)
+        entries = dict(zip(list1, self.positions))
+        for doc_id, positions in zip(list2, other_posting_list.positions):
+            if doc_id in entries:
+                positions = array('I', sorted(set(entries[doc_id]).union(positions)))
+            entries[doc_id] = positions
+        doc_ids = sorted(entries)
+        return PositionalPostingList(array('I', doc_ids), [entries[doc_id] for doc_id in doc_ids])
+
+    def memory_size(self):
+        return super().memory_size() + sys.getsizeof(self.positions) + sum(
+            sys.getsizeof(positions) for positions in self.positions)
+
+    def __str__(self):
+        return " ".join(f"{doc_id}:{','.join(map(str, positions))}" for doc_id, positions in zip(self.doc_ids, self.positions))
+
+
+def parse_posting(save_string):
+    '''
+    posting list of a save string, positional if it has positions
+    '''
+    if ':' in save_string:
+        return PositionalPostingList(save_string)
+    return PostingList(save_string)
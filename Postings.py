@@ -1,46 +1,212 @@
-from SkipLinkedList import SkipLinkedList
+import mmap
+import sys
+
+from Compression import KIND_BITMAP, MAGIC, decode_bitmap, decode_posting, max_record_size, record_kind
+from KGramIndex import expand_wildcard
+from LRUCache import LRUCache
+from PositionalIndex import (document_lengths_path, frequencies_path, load_document_lengths, load_positional_index,
+                             load_term_frequencies, positions_path)
+from PostingList import BitmapPostingList, ComplementPostingList, LazyPostingList, PostingList
+
+# approximate size of a cached PostingList and its array, excluding the doc ids themselves
+POSTING_OVERHEAD = sys.getsizeof(PostingList()) + sys.getsizeof(PostingList().doc_ids)
+
+
+def posting_size(posting):
+    '''
+    approximate number of bytes held by a decoded posting list (of its excluded list for a complement, of its bitmap for a bitmap)
+    '''
+    if isinstance(posting, ComplementPostingList):
+        return POSTING_OVERHEAD + posting_size(posting.excluded)
+    if isinstance(posting, BitmapPostingList):
+        return POSTING_OVERHEAD + len(posting.bitmap)
+    return POSTING_OVERHEAD + 4 * posting.length
+
 
 class Postings:
-    def __init__(self, file_dir, dictionary):
+    def __init__(self, file_dir, dictionary, cache_budget = 0, kgram_index = None):
         '''
         initializes, making a file available for seeking
+        detects whether the postings file is text or binary (gap + variable byte encoded)
+        decoded postings are kept in an LRU cache of at most cache_budget bytes
+        wildcard terms are expanded with the kgram_index of the dictionary if given
+        the positions of a positional index, its term frequencies and document lengths are found next to the postings file
         '''
-        self.file = open(file_dir)
+        self.file = open(file_dir, 'rb')
+        self.binary = self.file.read(len(MAGIC)) == MAGIC
         self.dictionary = dictionary
+        self.kgram_index = kgram_index
+        self.positions = load_positional_index(positions_path(file_dir), dictionary)
+        self.frequencies = load_term_frequencies(frequencies_path(file_dir), dictionary)
+        self.lengths = load_document_lengths(document_lengths_path(file_dir))
+        self.cache = LRUCache(cache_budget, posting_size)
 
     def get_doc_ids(self, term):
         '''
         from a pointer, seek the line and convert it into a posting
         '''
-        if term not in self.dictionary.keys():
+        if term not in self.dictionary:
             return None
 
     def word_in_postings(self, term):
         '''
         checks if a given term is in the postings
         '''
-        return term in self.dictionary.keys()
+        return term in self.dictionary
+
+    def lookup(self, term):
+        '''
+        (df, pointer) of a term, or None if it is not in the postings, with a single search of the dictionary
+        '''
+        return self.dictionary.get(term)
 
     def get_df(self, term):
         '''
         retrieves the document frequency for a given term
         '''
-        if self.word_in_postings(term):
-            return self.dictionary[term][0]
+        entry = self.dictionary.get(term)
+        return entry[0] if entry else 0
+
+    def expand(self, pattern):
+        '''
+        sorted terms in the dictionary matching a wildcard pattern
+        '''
+        return expand_wildcard(pattern, self.dictionary, self.kgram_index)
+
+    def has_positions(self):
+        return self.positions is not None
+
+    def get_positions(self, term, doc_ids = None):
+        '''
+        (doc id, array of positions) of a term in each of the sorted doc_ids that contain it (all of them if None)
+        '''
+        return self.positions.get_positions(term, doc_ids)
+
+    def has_frequencies(self):
+        return self.frequencies is not None
+
+    def get_frequencies(self, term):
+        '''
+        (largest frequency, frequencies in the order of the doc ids of its posting) of a term
+        '''
+        return self.frequencies.get_frequencies(term)
+
+    def get_document_lengths(self):
+        '''
+        dictionary of doc id -> number of tokens, read when the postings are opened
+        '''
+        return self.lengths
+
+    def get_posting(self, term, entry = None):
+        '''
+        retrieve the posting for a term, from the cache if possible, at its entry if already looked up
+        returns an empty PostingList if term not found
+        '''
+        posting = self.cache.get(term) if self.cache.budget else None
+        if posting is None:
+            entry = entry or self.lookup(term)
+            if entry is None:
+                return PostingList()
+            posting = self.read_posting(term, entry)
+            if self.cache.budget:
+                self.cache.put(term, posting)
+        return posting
+
+    def read_posting(self, term, entry = None):
+        '''
+        read and decode the posting for a term from the postings file, at its (df, pointer) entry if already looked up
+        '''
+        df, pointer = entry or self.dictionary[term]
+        self.file.seek(pointer)
+        if self.binary:
+            return decode_record(self.file.read(max_record_size(df)))
+        return PostingList(self.file.readline().decode())
+
+    def reopen(self):
+        '''
+        opens a new file handle, e.g. in a forked process that must not share the parent's file offset
+        '''
+        self.file = open(self.file.name, 'rb')
+
+    def close(self):
+        self.file.close()
+        if self.positions:
+            self.positions.close()
+        if self.frequencies:
+            self.frequencies.close()
+
+
+def decode_record(buffer):
+    '''
+    decodes a binary record into a BitmapPostingList or a PostingList depending on its kind
+    '''
+    if record_kind(buffer) == KIND_BITMAP:
+        df, bitmap, start = decode_bitmap(buffer)
+        return BitmapPostingList(bitmap, df, start)
+    return PostingList(decode_posting(buffer))
+
+
+def decode_text_posting(view):
+    return PostingList(bytes(view).decode()).doc_ids
+
+
+class MappedPostings(Postings):
+    '''
+    drop-in replacement for Postings that maps the postings file into memory once
+    postings are returned as lazily decoded views into the mapped buffer, so lookups need no
+    seek or read syscalls and can be shared between threads
+    '''
+    def __init__(self, file_dir, dictionary, cache_budget = 0, kgram_index = None):
+        self.file = open(file_dir, 'rb')
+        if self.file.seek(0, 2):
+            self.buffer = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
         else:
-            return 0
+            # empty files cannot be mapped
+            self.buffer = b""
+        self.binary = self.buffer[:len(MAGIC)] == MAGIC
+        self.dictionary = dictionary
+        self.kgram_index = kgram_index
+        self.positions = load_positional_index(positions_path(file_dir), dictionary)
+        self.frequencies = load_term_frequencies(frequencies_path(file_dir), dictionary)
+        self.lengths = load_document_lengths(document_lengths_path(file_dir))
+        self.cache = LRUCache(cache_budget, posting_size)
 
-    def get_posting(self, term):
+    def read_posting(self, term, entry = None):
         '''
-        retrieve the posting for a term
-        returns an empty SkipLinkedList if term not found
+        retrieve the posting for a term as a view into the mapped file, at its (df, pointer) entry if already looked up
         '''
-        if not self.word_in_postings(term):
-            return SkipLinkedList()
+        df, pointer = entry or self.dictionary[term]
+        if self.binary:
+            end = pointer + max_record_size(df)
+            if record_kind(self.buffer, pointer) == KIND_BITMAP:
+                # bitmaps are decoded with slice copies, and their doc ids only when they are read
+                view = memoryview(self.buffer)[pointer:end]
+                posting = decode_record(view)
+                view.release()
+                return posting
+            decode = decode_posting
         else:
-            pointer = self.dictionary[term][1]
-            self.file.seek(pointer)
-            return SkipLinkedList(self.file.readline())
+            end = self.buffer.find(b"\n", pointer)
+            if end == -1:
+                end = len(self.buffer)
+            decode = decode_text_posting
+        return LazyPostingList(memoryview(self.buffer)[pointer:end], decode, df)
+
+    def reopen(self):
+        '''
+        the mapping has no file offset and can be shared as is
+        '''
+        pass
 
     def close(self):
-        self.file.close()
\ No newline at end of file
+        if isinstance(self.buffer, mmap.mmap):
+            try:
+                self.buffer.close()
+            except BufferError:
+                # undecoded postings still reference the buffer, it is unmapped once they are released
+                pass
+        self.file.close()
+        if self.positions:
+            self.positions.close()
+        if self.frequencies:
+            self.frequencies.close()
@@ -1,21 +1,46 @@
 import re
-import nltk
+import time
 
-from SkipLinkedList import SkipLinkedList
+from KGramIndex import is_wildcard
+from LRUCache import LRUCache
+from PositionalIndex import is_phrase, phrase_intersection, phrase_terms
+from Normalizer import Normalizer
+from PostingList import INTERSECTION_ALGORITHMS, ComplementPostingList, PostingList
+from Postings import posting_size
+from QueryPlanner import QueryPlanner
+from Ranker import Ranker
+
+# 'array' evaluates queries on arrays of doc ids in Python, 'numpy' with vectorized numpy set operations
+ENGINES = ('array', 'numpy')
 
 
 class QueryParser:
     '''
     handles queries. stores postings and other relevant information to resolve queries
     '''
-    def __init__(self, postings, full_list):
+    def __init__(self, postings, full_list, normalizer = None, result_cache_budget = 0, engine = 'array'):
         '''
-        initialises with postings and a full list
+        initialises with postings, a full list and the normalizer shared with the indexer
+        results of subexpressions are kept across queries in an LRU cache of at most result_cache_budget bytes
+        with the numpy engine, postings are converted to numpy arrays as they are read
         '''
         self.operators = operators = ('AND', 'OR', 'NOT')
+        self.engine = engine
+        self.convert = None
+        self.union_all = PostingList.OR_all
+        if engine == 'numpy':
+            # numpy is an optional dependency, only imported for this engine
+            from NumpyPostingList import NumpyPostingList
+            self.convert = NumpyPostingList.from_posting
+            self.union_all = NumpyPostingList.OR_all
+            full_list = self.convert(full_list)
         self.postings = postings
         self.full_list = full_list
-        self.ps = nltk.PorterStemmer()
+        self.normalizer = normalizer if normalizer else Normalizer()
+        self.results = LRUCache(result_cache_budget, posting_size)
+        self.planner = QueryPlanner(postings, full_list)
+        # scheme -> ranker, made on the first ranked query with the scheme
+        self.rankers = {}
 
     def is_invalid_query(self, query):
         '''
@@ -55,16 +80,32 @@ class QueryParser:
         return False
 
     def normalize_word(self, word):
-        return self.ps.stem(word).lower()
+        '''
+        wildcard patterns are only lowercased, since the stem of a part of a word is meaningless
+        '''
+        if is_wildcard(word):
+            return word.lower()
+        return self.normalizer.normalize(word)
+
+    def normalize_phrase(self, phrase):
+        '''
+        a quoted phrase of several words stays one token, "term term", of normalized terms
+        '''
+        words = phrase_terms(phrase)
+        if not words:
+            raise ValueError("Invalid Query")
+        if len(words) == 1:
+            return self.normalize_word(words[0])
+        return '"' + " ".join(self.normalize_word(word) for word in words) + '"'
 
     def tokenize_query(self, query):
-        # splits queries based on operators
+        # splits queries based on operators and quoted phrases
         wordlist = []
         if self.is_invalid_query(query):
             raise ValueError("Invalid Query")
         operators = ('AND', 'OR', 'NOT', '(', ')')
         regex_pattern = '|'.join(map(re.escape, operators))
-        wordlist = re.split(f'({regex_pattern})', query)
+        wordlist = re.split(f'("[^"]*"|{regex_pattern})', query)
 
         query_tokens = []
         for word in wordlist:
@@ -72,6 +113,8 @@ class QueryParser:
             if word:
                 if word in operators:
                     query_tokens.append(word)
+                elif is_phrase(word):
+                    query_tokens.append(self.normalize_phrase(word))
                 else:
                     query_tokens.append(self.normalize_word(word))
         return query_tokens
@@ -89,7 +132,7 @@ class QueryParser:
             raise ValueError("Invalid Query")
         tokens = self.tokenize_query(query)
         for token in tokens:
-            if " " in token:
+            if " " in token and not is_phrase(token):
                 raise ValueError("Invalid Query")
 
         # shunting yard
@@ -117,144 +160,191 @@ class QueryParser:
             output_queue.append(operator_stack.pop())
         return output_queue
 
-    def AND(self, list1, list2):
-        return list1.AND(list2)
+    def AND(self, list1, list2, algorithm = None):
+        return list1.AND(list2, algorithm)
 
     def OR(self, list1, list2):
         return list1.OR(list2)
 
-    def NOT(self, list):
-        return self.full_list.NOT(list)
-
+    def get_posting(self, term, entry = None):
+        posting = self.postings.get_posting(term, entry)
+        return self.convert(posting) if self.convert else posting
 
-
-    def organize_query(self, query):
+    def NOT(self, list):
         '''
-        converts each query into a tuple (df, query) for optimization
+        negation is kept as a complement of the full list, which is only materialized if it is the final result
         '''
-        term_df_query = []
-        operators = ['AND', 'NOT', 'OR']
-        for term in query:
-            if term in operators:
-                term_df_query.append(term)
-            else:
-                term_df_query.append((term, self.postings.get_df(term)))
-        return term_df_query
-
-    def capture_brackets(self, query):
-        return re.findall(r'\((.*?)\)', query)
+        if isinstance(list, ComplementPostingList):
+            return list.excluded
+        return ComplementPostingList(self.full_list, list)
 
-    def split_by_separator(self, list_to_split, sep, include_separator = False):
+    def evaluate_node(self, node, evaluated, limit = None, stats = None):
         '''
-        splits a list of tuples into sublists via a separator (the separator can also be added back into list)
+        evaluates a plan, looking up every subexpression by its key
+        in evaluated (results of this query) and then in the result cache (results of earlier queries)
+        an intersection stops reading operands as soon as it is empty
+        with a limit, the result is only correct in its first limit doc ids
+        time spent in unions of wildcards and in positions of phrases is added to stats (see plan) if given
         '''
-        sublists = []
-        chunk = []
-        for val in list_to_split:
-            if val == sep:
-                sublists.append(chunk)
-                if include_separator:
-                    sublists.append(sep)
-                chunk = []
-            else:
-                chunk.append(val)
-        sublists.append(chunk)
-        return sublists
+        if node.operator is None:
+            return self.get_posting(node.key, node.entry)
+        if node.operator == 'WILDCARD':
+            return self.evaluate_wildcard(node, evaluated, limit, stats)
+        if node.operator == 'PHRASE':
+            return self.evaluate_cached(node.key, evaluated, lambda: self.evaluate_phrase(node, stats))
+        if limit is not None and node.operator == 'OR':
+            # the first doc ids of a union are among the first doc ids of its operands
+            key = f"{node.key}[:{limit}]"
+            if key not in evaluated:
+                result = PostingList()
+                for operand in node.operands:
+                    result = result.OR(self.evaluate_node(operand, evaluated, limit, stats).head(limit))
+                evaluated[key] = result
+            return evaluated[key]
+        if node.key in evaluated:
+            return evaluated[node.key]
+        result = self.results.get(node.key) if self.results.budget else None
+        if result is None:
+            result = self.evaluate_node(node.operands[0], evaluated, stats=stats)
+            if node.operator == 'NOT':
+                result = self.NOT(result)
+            start = 1
+            if node.operator == 'AND':
+                # the lists of an AND come before its complements and are intersected all at once
+                lists = [result]
+                while (len(lists) < len(node.operands) and node.steps[len(lists)] in INTERSECTION_ALGORITHMS and
+                       lists[-1].length):
+                    lists.append(self.evaluate_node(node.operands[len(lists)], evaluated, stats=stats))
+                result = PostingList.AND_all(lists, node.steps[1:len(lists)])
+                start = len(lists)
+            for operand, step in zip(node.operands[start:], node.steps[start:]):
+                if node.operator == 'AND':
+                    if not result.length:
+                        break
+                    result = self.AND(result, self.evaluate_node(operand, evaluated, stats=stats), step)
+                else:
+                    result = self.OR(result, self.evaluate_node(operand, evaluated, stats=stats))
+            if self.results.budget:
+                self.results.put(node.key, result)
+        evaluated[node.key] = result
+        return result
 
-    def optimize_and_score_flat_query(self, query):
-        ''' Given a list of tuples of (term, df) and operators,
-        optimizes the AND statements and consolidates into a single big term with df score
+    def evaluate_cached(self, key, evaluated, evaluate):
         '''
-        chunks = self.split_by_separator(query, 'OR')
-
-        # chunks are guaranteed to have no OR operators
-        # consolidate all NOT:
-        NOT_consolidated_chunks = []
-        for chunk in chunks:
-            consolidated_chunk = []
-            for index, token in enumerate(chunk):
-                if index > 0 and chunk[index - 1] == 'NOT' and token != 'AND':
-                    new_df = self.full_list.length - token[1]
-                    consolidated_chunk.append((f'NOT {token[0]}', new_df))
-                elif token != 'NOT' and token != 'AND':
-                    consolidated_chunk.append(token)
-            NOT_consolidated_chunks.append(consolidated_chunk)
+        the result of a subexpression from evaluated or the result cache, or else from evaluate()
+        '''
+        if key in evaluated:
+            return evaluated[key]
+        result = self.results.get(key) if self.results.budget else None
+        if result is None:
+            result = evaluate()
+            if self.results.budget:
+                self.results.put(key, result)
+        evaluated[key] = result
+        return result
+
+    def evaluate_wildcard(self, node, evaluated, limit = None, stats = None):
+        '''
+        unions the postings of the terms a wildcard expanded to in one k-way union
+        with a limit, only the first limit doc ids of each posting are needed
+        '''
+        def evaluate():
+            postings = [self.get_posting(operand.key, operand.entry) for operand in node.operands]
+            if limit is not None:
+                postings = [posting.head(limit) for posting in postings]
+            start = time.perf_counter()
+            result = self.union_all(postings)
+            if stats is not None:
+                stats['union_time'] += time.perf_counter() - start
+            return result
+        return self.evaluate_cached(node.key if limit is None else f"{node.key}[:{limit}]", evaluated, evaluate)
+
+    def evaluate_phrase(self, node, stats = None):
+        '''
+        intersects the postings of the terms of a phrase, then keeps the documents of the intersection
+        in which the terms are consecutive; positions are only read for those documents
+        '''
+        candidates = PostingList.AND_all([self.get_posting(operand.key, operand.entry) for operand in node.operands])
+        if not candidates.length:
+            return candidates
+        start = time.perf_counter()
+        # rarest terms first, so fewer documents are left to look up the positions of the others in
+        phrase = sorted(enumerate(operand.key for operand in node.operands),
+                        key=lambda entry: node.operands[entry[0]].estimate)
+        result = PostingList(phrase_intersection(phrase, list(candidates), self.postings.get_positions))
+        if stats is not None:
+            stats['phrase_time'] += time.perf_counter() - start
+        return self.convert(result) if self.convert else result
+
+    def plan(self, query, stats = None):
+        '''
+        plans a query in RPN, starting its stats if given: terms its wildcards expanded to, time spent expanding
+        and unioning them, and time spent comparing the positions of the terms of its phrases
+        stats are kept in a dictionary of each query, since queries may be evaluated concurrently
+        '''
+        if stats is not None:
+            stats.update(union_time=0.0, phrase_time=0.0)
+        return self.planner.plan(query, stats)
 
-        # terms between AND operators can freely move around
-        # maximum df scored for chunk is the minimum of all AND operators
-        consolidated_chunks = []
-        for chunk in NOT_consolidated_chunks:
-            df = min([token[1] for token in chunk])
-            consolidated_chunks.append(
-                (" AND ".join([str(tuple[0]) for tuple in sorted(chunk, key=lambda x: x[1])]), df))
+    def plan_query(self, query_string, stats = None):
+        return self.plan(self.parse_query(query_string), stats)
 
-        # df score is sum of all OR terms
-        return f'({" OR ".join([token for token, df in consolidated_chunks])})', \
-               min(self.full_list.length, sum([df for token, df in consolidated_chunks]))
+    def evaluate_query(self, query, stats = None):
+        return self.evaluate_node(self.plan(query, stats), {}, stats=stats)
 
-    def replace_brackets(self, query, bracket_queries):
+    def explain_query(self, query_string):
         '''
-        replace the items between brackets in tokenized query with consolidated ones
+        the plan that resolve_query follows for a query, one line per node
         '''
-        flat_query = []
-        bracket_index = 0
-        in_bracket = False
-        for token in query:
-            if token[0] == ')':
-                in_bracket = False
-                continue
-            elif in_bracket:
-                continue
-
-            if token[0] == '(':
-                flat_query.append(bracket_queries[bracket_index])
-                bracket_index += 1
-                in_bracket = True
-            else:
-                flat_query.append(token)
-        return flat_query
+        try:
+            return self.planner.explain(self.plan_query(query_string))
+        except ValueError:
+            return "Invalid Query"
 
-    def optimize_query(self, query):
+    def stream_query(self, query_string, limit = None, count = False, chunk_size = 65536, stats = None):
         '''
-        infix optimization of AND terms assuming no nested brackets
-        takes a string
+        yields the results of a query as pieces of its value string (nothing if the query is invalid)
+        only its first limit doc ids if limit is given, or only the number of results if count
+        the stats of the query are kept in stats if given (left empty if the query is invalid)
         '''
-        bracket_queries = []
-        for subquery in self.capture_brackets(query):
-            tokens = self.organize_query(self.tokenize_query(subquery))
-            bracket_queries.append(self.optimize_and_score_flat_query(tokens))
-
-        final_query = self.replace_brackets(self.organize_query(self.tokenize_query(query)), bracket_queries)
-        return self.optimize_and_score_flat_query(final_query)[0][1:-1]
-
-    def evaluate_query(self, query):
-        operators = ['AND', 'NOT', 'OR']
-        stack = []
-        for term in query:
-            if term not in operators:
-                stack.append(self.postings.get_posting(term))
-            else:
-                # If token is operator, perform the operation on operands from the stack
-                if term == 'NOT':
-                    operand = stack.pop()
-                    result = self.NOT(operand)
-                else:
-                    operand1 = stack.pop()
-                    operand2 = stack.pop()
-                    if term == 'AND':
-                        result = self.AND(operand1, operand2)
-                    elif term == 'OR':
-                        result = self.OR(operand1, operand2)
-                    else:
-                        result = None
-                # Push the result of the operation back onto the stack
-                stack.append(result)
-        return stack.pop()
-
-    def resolve_query(self, query_string):
+        if stats is None:
+            stats = {}
         try:
-            optimized_query = self.optimize_query(query_string)
-            postfix = self.parse_query(optimized_query)
+            plan = self.plan_query(query_string, stats)
         except ValueError:
-            return SkipLinkedList()
-        return self.evaluate_query(postfix).get_value_string()
+            stats.clear()
+            if count:
+                yield "0"
+            return
+        result = self.evaluate_node(plan, {}, None if count else limit, stats)
+        if count:
+            # complements and bitmaps know their length without being decoded
+            yield str(result.length)
+            return
+        if limit is not None:
+            result = result.head(limit)
+        elif self.convert:
+            # a complement is materialized with numpy too
+            result = self.convert(result)
+        yield from result.iter_value_strings(chunk_size)
+
+    def resolve_query(self, query_string, limit = None, count = False, stats = None):
+        return "".join(self.stream_query(query_string, limit, count, stats=stats))
+
+    def rank_query(self, query_string, k = 10, scheme = 'bm25', pruning = 'wand', stats = None):
+        '''
+        the doc ids of the k best documents for a free text query, best first
+        every word counts as a term, operators, parentheses and quotes are ignored
+        the documents scored and the time spent ranking them are kept in stats if given
+        '''
+        ranker = self.rankers.get(scheme)
+        if ranker is None:
+            ranker = self.rankers[scheme] = Ranker(self.postings, scheme)
+        words = re.findall(r'[^\s()"]+', query_string)
+        terms = [self.normalize_word(word) for word in words if word not in self.operators and not is_wildcard(word)]
+        if stats is None:
+            stats = {}
+        start = time.perf_counter()
+        ranking = ranker.rank(terms, k, pruning, stats)
+        stats['rank_time'] = time.perf_counter() - start
+        return " ".join(str(doc_id) for _, doc_id in ranking)
@@ -0,0 +1,218 @@
+import time
+
+from KGramIndex import is_wildcard
+from PositionalIndex import is_phrase, phrase_terms
+from PostingList import choose_intersection, intersection_cost
+
+
+class PlanNode:
+    '''
+    node of a query plan: a term (no operator) or an operator over operands in evaluation order
+    steps[i] is how operands[i] is combined into the result of the operands before it (None for the first)
+    estimate is the expected number of doc ids of the result, cost the expected work to evaluate it
+    complement is set when the result is kept as a complement of the full list (see ComplementPostingList)
+    entry is the dictionary entry of a term found while planning, so evaluation reads its posting without another search
+    '''
+    def __init__(self, key, operator = None, operands = None, steps = None, estimate = 0, cost = 0, complement = False,
+                 entry = None):
+        self.key = key
+        self.operator = operator
+        self.operands = operands if operands else []
+        self.steps = steps if steps else []
+        self.estimate = estimate
+        self.cost = cost
+        self.complement = complement
+        self.entry = entry
+
+    def describe(self):
+        if self.operator is None:
+            return f"{self.key} (df {self.estimate})"
+        if self.operator == 'PHRASE':
+            return f"{self.key} (phrase, est. {self.estimate:.0f}, cost {self.cost:.0f})"
+        if self.operator == 'WILDCARD':
+            return f"{self.key} (expands to {len(self.operands)} terms, est. {self.estimate:.0f}, cost {self.cost:.0f})"
+        return f"{self.operator} (est. {self.estimate:.0f}, cost {self.cost:.0f})"
+
+
+class QueryPlanner:
+    '''
+    turns a query in RPN into a plan: ANDs and ORs are flattened across any nesting of brackets,
+    cardinalities are estimated from the document frequencies in the dictionary assuming independent terms,
+    and each operator gets the evaluation order and intersection algorithm with the lowest estimated cost
+    wildcard terms are expanded into the matching terms of the dictionary while planning
+    and phrases are planned as an intersection of their terms followed by a check of their positions
+    '''
+    def __init__(self, postings, full_list):
+        self.postings = postings
+        self.full_list = full_list
+
+    @property
+    def total(self):
+        return self.full_list.length
+
+    def fraction(self, node):
+        return node.estimate / self.total if self.total else 0
+
+    def stored_size(self, node):
+        '''
+        doc ids actually held by the result of a node, which is the excluded list for a complement
+        '''
+        return self.total - node.estimate if node.complement else node.estimate
+
+    def plan(self, query, stats = None):
+        '''
+        plans a query in RPN
+        a complement at the root has to be materialized, so the full list is added to its cost
+        the number of expanded terms and the time spent expanding them are kept in stats, a dictionary of this query
+        '''
+        if stats is None:
+            stats = {}
+        stats.update(expanded_terms=0, expansion_time=0.0)
+        stack = []
+        for term in query:
+            if term in ('AND', 'OR', 'NOT') and len(stack) < (1 if term == 'NOT' else 2):
+                raise ValueError("Invalid Query")
+            if term == 'NOT':
+                stack.append(self.plan_not(stack.pop()))
+            elif term in ('AND', 'OR'):
+                right, left = stack.pop(), stack.pop()
+                stack.append(self.plan_operator(term, [left, right]))
+            elif is_phrase(term):
+                stack.append(self.plan_phrase(term))
+            elif is_wildcard(term):
+                stack.append(self.plan_wildcard(term, stats))
+            else:
+                stack.append(self.plan_term(term))
+        if len(stack) != 1:
+            raise ValueError("Invalid Query")
+        root = stack.pop()
+        if root.complement:
+            root.cost += self.total
+        return root
+
+    def plan_term(self, term):
+        '''
+        a term is estimated by its document frequency, from the entry it is then read at
+        '''
+        entry = self.postings.lookup(term)
+        return PlanNode(term, estimate=entry[0] if entry else 0, entry=entry)
+
+    def plan_not(self, operand):
+        '''
+        negation is free: it either wraps the operand in a complement or cancels a double negation
+        '''
+        if operand.operator == 'NOT':
+            return operand.operands[0]
+        return PlanNode(f"NOT {operand.key}", 'NOT', [operand], [None], self.total - operand.estimate, operand.cost,
+                        not operand.complement)
+
+    def plan_wildcard(self, pattern, stats):
+        '''
+        a wildcard is the union of the postings of the terms it expands to, read all at once in one k-way union
+        '''
+        start = time.perf_counter()
+        terms = self.postings.expand(pattern)
+        stats['expansion_time'] += time.perf_counter() - start
+        stats['expanded_terms'] += len(terms)
+        operands = [self.plan_term(term) for term in terms]
+        estimate = 0
+        for operand in operands:
+            estimate = self.total - (self.total - estimate) * (1 - self.fraction(operand))
+        return PlanNode(pattern, 'WILDCARD', operands, [None] + ['union'] * (len(operands) - 1), estimate,
+                        sum(operand.estimate for operand in operands))
+
+    def plan_phrase(self, phrase):
+        '''
+        a phrase is the intersection of the postings of its terms, in which the positions of the terms are then
+        compared for the documents left; its terms stay in phrase order
+        the estimate is that of the intersection, an upper bound
+        '''
+        if not self.postings.has_positions():
+            raise ValueError("Phrase queries need an index built with --positions")
+        operands = [self.plan_term(term) for term in phrase_terms(phrase)]
+        estimate = operands[0].estimate
+        for operand in operands[1:]:
+            estimate = estimate * self.fraction(operand)
+        cost = sum(operand.estimate for operand in operands) + estimate * len(operands)
+        return PlanNode(phrase, 'PHRASE', operands, [None] + ['positions'] * (len(operands) - 1), estimate, cost)
+
+    def plan_operator(self, operator, operands):
+        '''
+        flattens nested operands of the same operator, then orders and costs them
+        '''
+        flat = []
+        for operand in operands:
+            flat.extend(operand.operands if operand.operator == operator else [operand])
+        if operator == 'AND':
+            return self.plan_and(flat)
+        return self.plan_or(flat)
+
+    def plan_and(self, operands):
+        '''
+        intersects the lists from the shortest up, so intermediate results stay small,
+        then subtracts the excluded lists of complements (A AND NOT B = A - B)
+        '''
+        lists = sorted((operand for operand in operands if not operand.complement), key=lambda node: node.estimate)
+        complements = sorted((operand for operand in operands if operand.complement), key=lambda node: node.estimate)
+        ordered = lists + complements
+        steps = [None]
+        cost = sum(operand.cost for operand in ordered)
+        estimate = ordered[0].estimate
+        for operand in ordered[1:]:
+            if operand.complement and lists:
+                step = 'difference'
+                cost += estimate + self.stored_size(operand)
+            elif operand.complement:
+                # NOT A AND NOT B = NOT (A OR B)
+                step = 'union'
+                cost += self.stored_size(operand) + self.total - estimate
+            else:
+                step = choose_intersection(estimate, operand.estimate)
+                cost += intersection_cost(step, estimate, operand.estimate)
+            steps.append(step)
+            estimate = estimate * self.fraction(operand)
+        return PlanNode(self.operator_key('AND', ordered), 'AND', ordered, steps, estimate, cost, not lists)
+
+    def plan_or(self, operands):
+        '''
+        unions the lists from the shortest up; any complement makes the result a complement
+        '''
+        ordered = sorted(operands, key=lambda node: (node.complement, node.estimate))
+        steps = [None]
+        cost = sum(operand.cost for operand in ordered)
+        left = ordered[0]
+        estimate = left.estimate
+        complement = left.complement
+        for operand in ordered[1:]:
+            if complement and operand.complement:
+                # NOT A OR NOT B = NOT (A AND B)
+                step = 'intersection'
+            elif complement or operand.complement:
+                # B OR NOT A = NOT (A - B)
+                step = 'difference'
+            else:
+                step = 'union'
+            cost += (self.total - estimate if complement else estimate) + self.stored_size(operand)
+            steps.append(step)
+            estimate = self.total - (self.total - estimate) * (1 - self.fraction(operand))
+            complement = complement or operand.complement
+        return PlanNode(self.operator_key('OR', ordered), 'OR', ordered, steps, estimate, cost, complement)
+
+    def operator_key(self, operator, operands):
+        '''
+        canonical key of an operator, with its operands sorted so equal subexpressions share a key in any order
+        '''
+        return f"({f' {operator} '.join(sorted(operand.key for operand in operands))})"
+
+    def explain(self, node, depth = 0, step = None):
+        '''
+        renders a plan as indented lines, one per node, with the step that combines it into its parent
+        '''
+        prefix = f"{step}: " if step else ""
+        lines = [f"{'  ' * depth}{prefix}{node.describe()}"]
+        if node.operator == 'NOT':
+            lines.append(self.explain(node.operands[0], depth + 1))
+        else:
+            for operand, operand_step in zip(node.operands, node.steps):
+                lines.append(self.explain(operand, depth + 1, operand_step))
+        return "\n".join(lines)
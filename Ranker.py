@@ -0,0 +1,240 @@
+import heapq
+import math
+
+from PostingList import gallop
+
+# scoring schemes of ranked retrieval
+SCHEMES = ('bm25', 'tfidf')
+# 'wand' and 'maxscore' skip documents that cannot reach the top k, 'none' scores every matching document
+PRUNING = ('wand', 'maxscore', 'none')
+
+BM25_K1 = 1.2
+BM25_B = 0.75
+
+# doc id past the end of every posting
+END = float('inf')
+
+# relative slack on score bounds, so that rounding in sums of bounds never prunes a document that belongs in the top k
+BOUND_SLACK = 1e-9
+
+
+class TermCursor:
+    '''
+    position in the posting of a query term during document-at-a-time scoring,
+    with the frequencies of the term aligned with its doc ids
+    '''
+    def __init__(self, order, doc_ids, frequencies, weight, upper_bound):
+        self.order = order
+        self.doc_ids = doc_ids
+        self.frequencies = frequencies
+        self.weight = weight
+        self.upper_bound = upper_bound
+        self.index = 0
+        self.doc = doc_ids[0] if len(doc_ids) else END
+
+    def next(self):
+        self.index += 1
+        self.doc = self.doc_ids[self.index] if self.index < len(self.doc_ids) else END
+
+    def seek(self, target):
+        '''
+        moves to the first doc id >= target
+        '''
+        if self.doc >= target:
+            return
+        self.index = gallop(self.doc_ids, target, self.index)
+        self.doc = self.doc_ids[self.index] if self.index < len(self.doc_ids) else END
+
+    @property
+    def frequency(self):
+        return self.frequencies[self.index]
+
+
+class Ranker:
+    '''
+    ranks documents for free text queries by bm25 or tf-idf, document at a time over the postings of the query terms,
+    keeping the k best documents in a min-heap
+    needs the term frequencies and document lengths of a positional index
+    '''
+    def __init__(self, postings, scheme = 'bm25'):
+        if not postings.has_frequencies():
+            raise ValueError("ranked retrieval needs an index built with --frequencies or --positions")
+        self.postings = postings
+        self.scheme = scheme
+        self.lengths = postings.get_document_lengths()
+        self.documents = len(self.lengths)
+        self.average_length = sum(self.lengths.values()) / self.documents if self.documents else 0
+        self.shortest_length = min(self.lengths.values(), default=0)
+
+    def idf(self, df):
+        if self.scheme == 'bm25':
+            return math.log(1 + (self.documents - df + 0.5) / (df + 0.5))
+        return math.log10(self.documents / df)
+
+    def term_score(self, idf, frequency, length):
+        if self.scheme == 'bm25':
+            norm = BM25_K1 * (1 - BM25_B + BM25_B * length / self.average_length)
+            return idf * frequency * (BM25_K1 + 1) / (frequency + norm)
+        return idf * (1 + math.log10(frequency))
+
+    def cursors(self, terms):
+        '''
+        a cursor on the posting of every distinct term in the index, weighted by its count in the query,
+        with an upper bound on its score from its largest frequency in the shortest document
+        '''
+        counts = {}
+        for term in terms:
+            counts[term] = counts.get(term, 0) + 1
+        cursors = []
+        for term, count in sorted(counts.items()):
+            posting = self.postings.get_posting(term)
+            df = posting.length
+            if not df:
+                continue
+            doc_ids = posting.doc_ids
+            max_frequency, frequencies = self.postings.get_frequencies(term)
+            idf = self.idf(df)
+            upper_bound = count * self.term_score(idf, max_frequency, self.shortest_length)
+            cursors.append(TermCursor(len(cursors), doc_ids, frequencies, (count, idf), upper_bound))
+        return cursors
+
+    def score(self, cursors, doc):
+        '''
+        score of a document from the cursors on it, summed in term order so that every strategy gets the same score
+        '''
+        length = self.lengths[doc]
+        return sum(cursor.weight[0] * self.term_score(cursor.weight[1], cursor.frequency, length)
+                   for cursor in sorted(cursors, key=lambda cursor: cursor.order))
+
+    def rank(self, terms, k = 10, pruning = 'wand', stats = None):
+        '''
+        the k best (score, doc id) of the documents containing any of the terms, best first
+        ties go to the smaller doc id
+        the number of documents scored is kept in stats if given
+        '''
+        cursors = self.cursors(terms)
+        # the k best (score, -doc id) so far, worst at the top
+        top = []
+        scored = 0
+        if k > 0 and cursors:
+            if pruning == 'wand':
+                scored = self.rank_wand(cursors, k, top)
+            elif pruning == 'maxscore':
+                scored = self.rank_maxscore(cursors, k, top)
+            else:
+                scored = self.rank_exhaustive(cursors, k, top)
+        if stats is not None:
+            stats['scored_documents'] = scored
+        return [(score, -negative_doc) for score, negative_doc in sorted(top, reverse=True)]
+
+    @staticmethod
+    def offer(top, k, score, doc):
+        '''
+        keeps a document if it is among the k best so far, documents being offered in increasing doc id order
+        '''
+        if len(top) < k:
+            heapq.heappush(top, (score, -doc))
+        elif score > top[0][0]:
+            heapq.heapreplace(top, (score, -doc))
+
+    @staticmethod
+    def threshold(top, k):
+        '''
+        score a document must beat to enter the top k, with slack for rounding
+        '''
+        if len(top) < k:
+            return -END
+        return top[0][0] - BOUND_SLACK * abs(top[0][0])
+
+    def rank_exhaustive(self, cursors, k, top):
+        '''
+        scores every document of the postings, returns the number of documents scored
+        '''
+        scored = 0
+        while True:
+            doc = min(cursor.doc for cursor in cursors)
+            if doc == END:
+                return scored
+            matching = [cursor for cursor in cursors if cursor.doc == doc]
+            self.offer(top, k, self.score(matching, doc), doc)
+            scored += 1
+            for cursor in matching:
+                cursor.next()
+
+    def rank_wand(self, cursors, k, top):
+        '''
+        weak AND: with the cursors sorted by doc id, the pivot is the first document whose preceding cursors'
+        upper bounds add up to more than the threshold; no document before it can enter the top k,
+        so the preceding cursors skip to it, and it is scored once they are all on it
+        returns the number of documents scored
+        '''
+        scored = 0
+        while True:
+            cursors.sort(key=lambda cursor: cursor.doc)
+            threshold = self.threshold(top, k)
+            bound = 0
+            pivot = None
+            for i, cursor in enumerate(cursors):
+                if cursor.doc == END:
+                    break
+                bound += cursor.upper_bound
+                if bound > threshold:
+                    pivot = i
+                    break
+            if pivot is None:
+                return scored
+            doc = cursors[pivot].doc
+            if cursors[0].doc == doc:
+                matching = [cursor for cursor in cursors if cursor.doc == doc]
+                self.offer(top, k, self.score(matching, doc), doc)
+                scored += 1
+                for cursor in matching:
+                    cursor.next()
+            else:
+                for cursor in cursors[:pivot]:
+                    cursor.seek(doc)
+
+    def rank_maxscore(self, cursors, k, top):
+        '''
+        with the terms sorted by upper bound, those whose bounds add up to at most the threshold are non-essential:
+        only documents of the essential terms are candidates, and the non-essential terms are looked up
+        in a candidate, best first, until its score cannot reach the threshold
+        returns the number of documents fully scored
+        '''
+        cursors = sorted(cursors, key=lambda cursor: cursor.upper_bound)
+        # bounds[i] is the sum of the upper bounds of cursors[:i + 1]
+        bounds = []
+        total = 0
+        for cursor in cursors:
+            total += cursor.upper_bound
+            bounds.append(total)
+        first_essential = 0
+        scored = 0
+        while True:
+            threshold = self.threshold(top, k)
+            while first_essential < len(cursors) and bounds[first_essential] <= threshold:
+                first_essential += 1
+            if first_essential == len(cursors):
+                return scored
+            essential = cursors[first_essential:]
+            doc = min(cursor.doc for cursor in essential)
+            if doc == END:
+                return scored
+            matching = [cursor for cursor in essential if cursor.doc == doc]
+            length = self.lengths[doc]
+            partial = sum(cursor.weight[0] * self.term_score(cursor.weight[1], cursor.frequency, length)
+                          for cursor in matching)
+            for i in range(first_essential - 1, -1, -1):
+                if partial + bounds[i] <= threshold:
+                    break
+                cursor = cursors[i]
+                cursor.seek(doc)
+                if cursor.doc == doc:
+                    matching.append(cursor)
+                    partial += cursor.weight[0] * self.term_score(cursor.weight[1], cursor.frequency, length)
+            else:
+                self.offer(top, k, self.score(matching, doc), doc)
+                scored += 1
+            for cursor in essential:
+                if cursor.doc == doc:
+                    cursor.next()
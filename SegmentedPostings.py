@@ -0,0 +1,224 @@
+import fcntl
+import os
+import pickle
+
+from KGramIndex import kgram_index_path, load_kgram_index
+from LRUCache import LRUCache
+from PostingList import PostingList
+from Postings import MappedPostings, Postings, posting_size
+from TermDictionary import load_term_dictionary
+
+# a segmented index is a directory of immutable segments, each a directory with these files,
+# and a manifest listing the live segments in doc id order
+MANIFEST_FILE = "segments"
+# segments merged away, with the time they left the manifest, waiting to be deleted
+RETIRED_FILE = "retired"
+DICTIONARY_FILE = "dictionary.txt"
+POSTINGS_FILE = "postings.txt"
+FULL_LIST_FILE = "full_list.txt"
+
+
+def segment_file(directory, segment, file):
+    return os.path.join(directory, segment, file)
+
+
+def read_manifest(directory):
+    '''
+    returns the names of the live segments, oldest first
+    '''
+    path = os.path.join(directory, MANIFEST_FILE)
+    if not os.path.exists(path):
+        return []
+    with open(path, 'rb') as f:
+        return pickle.load(f)
+
+
+def write_manifest(directory, segments):
+    '''
+    replaces the manifest atomically, so readers always see a complete list of segments
+    '''
+    path = os.path.join(directory, MANIFEST_FILE)
+    with open(path + ".tmp", 'wb') as f:
+        pickle.dump(segments, f, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(path + ".tmp", path)
+
+
+def read_retired_segments(directory):
+    '''
+    returns (segment, time it was retired) of the segments merged away and not deleted yet
+    '''
+    path = os.path.join(directory, RETIRED_FILE)
+    if not os.path.exists(path):
+        return []
+    with open(path, 'rb') as f:
+        return pickle.load(f)
+
+
+def write_retired_segments(directory, retired):
+    path = os.path.join(directory, RETIRED_FILE)
+    with open(path + ".tmp", 'wb') as f:
+        pickle.dump(retired, f, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(path + ".tmp", path)
+
+
+class ManifestLock:
+    '''
+    exclusive lock held while reading and rewriting the manifest,
+    so an indexing run and a compaction can both update it
+    readers hold it shared while opening the live segments, so none is deleted before they have all its files open
+    '''
+    def __init__(self, directory, shared = False):
+        self.path = os.path.join(directory, MANIFEST_FILE + ".lock")
+        self.shared = shared
+
+    def __enter__(self):
+        self.file = open(self.path, 'a')
+        fcntl.flock(self.file, fcntl.LOCK_SH if self.shared else fcntl.LOCK_EX)
+        return self
+
+    def __exit__(self, *args):
+        fcntl.flock(self.file, fcntl.LOCK_UN)
+        self.file.close()
+
+
+def create_segment(directory):
+    '''
+    creates the directory of a new segment and returns its name
+    '''
+    numbers = [int(name.split("_")[1]) for name in os.listdir(directory) if name.startswith("segment_")]
+    number = max(numbers, default=-1) + 1
+    while True:
+        segment = f"segment_{number}"
+        try:
+            os.makedirs(os.path.join(directory, segment))
+            return segment
+        except FileExistsError:
+            number += 1
+
+
+def load_full_list(directory, segment):
+    with open(segment_file(directory, segment, FULL_LIST_FILE), 'rb') as f:
+        return pickle.load(f)
+
+
+def load_dictionary(directory, segment):
+    return load_term_dictionary(segment_file(directory, segment, DICTIONARY_FILE))
+
+
+class SegmentedPostings:
+    '''
+    same interface as Postings over every live segment of a segmented index
+    the posting of a term is the union of its postings in each segment
+    every file of the segments is read or opened here, so a compaction can retire them while searching
+    '''
+    def __init__(self, directory, mapped = False, cache_budget = 0):
+        self.directory = directory
+        postings_class = MappedPostings if mapped else Postings
+        self.segment_postings = []
+        with ManifestLock(directory, shared=True):
+            self.segments = read_manifest(directory)
+            for segment in self.segments:
+                kgram_index = load_kgram_index(kgram_index_path(segment_file(directory, segment, DICTIONARY_FILE)))
+                self.segment_postings.append(postings_class(segment_file(directory, segment, POSTINGS_FILE),
+                                                            load_dictionary(directory, segment),
+                                                            kgram_index=kgram_index))
+            self.full_list = PostingList()
+            for segment in self.segments:
+                self.full_list = self.full_list.OR(PostingList(load_full_list(directory, segment)))
+        self.full_list.update_skip_pointers()
+        self.lengths = {}
+        for postings in self.segment_postings:
+            self.lengths.update(postings.get_document_lengths())
+        self.cache = LRUCache(cache_budget, posting_size)
+
+    def word_in_postings(self, term):
+        return any(postings.word_in_postings(term) for postings in self.segment_postings)
+
+    def lookup(self, term):
+        '''
+        (df, entry of the term in each segment, None where it is absent), or None if it is in no segment
+        '''
+        entries = tuple(postings.lookup(term) for postings in self.segment_postings)
+        if all(entry is None for entry in entries):
+            return None
+        return sum(entry[0] for entry in entries if entry is not None), entries
+
+    def get_df(self, term):
+        '''
+        segments index disjoint documents, so document frequencies add up
+        '''
+        return sum(postings.get_df(term) for postings in self.segment_postings)
+
+    def expand(self, pattern):
+        '''
+        sorted terms matching a wildcard pattern in any segment
+        '''
+        return sorted(set().union(*(postings.expand(pattern) for postings in self.segment_postings)))
+
+    def has_positions(self):
+        return bool(self.segment_postings) and all(postings.has_positions() for postings in self.segment_postings)
+
+    def get_positions(self, term, doc_ids = None):
+        '''
+        positions of a term in the documents of every segment, which are in doc id order
+        '''
+        entries = []
+        for postings in self.segment_postings:
+            entries.extend(postings.get_positions(term, doc_ids))
+        return entries
+
+    def has_frequencies(self):
+        return bool(self.segment_postings) and all(postings.has_frequencies() for postings in self.segment_postings)
+
+    def get_frequencies(self, term):
+        '''
+        frequencies of a term in the documents of every segment, in the doc id order of its union posting
+        '''
+        max_frequency = 0
+        frequencies = []
+        for postings in self.segment_postings:
+            segment_max, segment_frequencies = postings.get_frequencies(term)
+            max_frequency = max(max_frequency, segment_max)
+            frequencies.extend(segment_frequencies)
+        return max_frequency, frequencies
+
+    def get_document_lengths(self):
+        return self.lengths
+
+    def get_posting(self, term, entry = None):
+        '''
+        retrieve the posting for a term across all segments, from the cache if possible, at its entry (see lookup)
+        if already looked up
+        returns an empty PostingList if term not found
+        '''
+        if not self.cache.budget:
+            return self.read_posting(term, entry)
+        posting = self.cache.get(term)
+        if posting is None:
+            posting = self.read_posting(term, entry)
+            self.cache.put(term, posting)
+        return posting
+
+    def read_posting(self, term, entry = None):
+        entry = entry or self.lookup(term)
+        if entry is None:
+            return PostingList()
+        posting = PostingList()
+        for postings, entry in zip(self.segment_postings, entry[1]):
+            if entry is not None:
+                posting = posting.OR(postings.read_posting(term, entry))
+        return posting
+
+    def get_full_list(self):
+        '''
+        all doc ids of the live segments
+        '''
+        return self.full_list
+
+    def reopen(self):
+        for postings in self.segment_postings:
+            postings.reopen()
+
+    def close(self):
+        for postings in self.segment_postings:
+            postings.close()
@@ -0,0 +1,65 @@
+import sys
+from array import array
+
+from PostingList import PositionalPostingList, PostingList
+
+
+class SpimiBlock:
+    '''
+    in-memory inverted index of term -> doc ids for one SPIMI block
+    doc ids are appended to a compact array('I') per term, 4 bytes per posting
+    for positional indexes, the array of positions of the term in each document is kept alongside
+    keeps a running count of the bytes it holds (dictionary table, term strings and doc id arrays)
+    so blocks can be flushed at a real memory budget
+    '''
+    def __init__(self):
+        self.postings = {}
+        # term -> list of the positions in each of its documents, only for positional indexes
+        self.positions = {}
+        # bytes held outside the dictionaries' own tables
+        self.contents_size = 0
+
+    @property
+    def size(self):
+        return sys.getsizeof(self.postings) + sys.getsizeof(self.positions) + self.contents_size
+
+    def add(self, term, document_id, positions = None):
+        '''
+        adds a document to the posting of a term, documents must be added in increasing doc id order
+        so a repeated document can only be the last one of the posting
+        positions (an array) are the positions of the term in the document, given once per document
+        '''
+        doc_ids = self.postings.get(term)
+        if doc_ids is None:
+            doc_ids = self.postings[term] = array('I')
+            self.contents_size += sys.getsizeof(term) + sys.getsizeof(doc_ids)
+            if positions is not None:
+                self.positions[term] = []
+                self.contents_size += sys.getsizeof(self.positions[term])
+        if not doc_ids or doc_ids[-1] != document_id:
+            size_before = sys.getsizeof(doc_ids)
+            doc_ids.append(document_id)
+            self.contents_size += sys.getsizeof(doc_ids) - size_before
+            if positions is not None:
+                term_positions = self.positions[term]
+                size_before = sys.getsizeof(term_positions)
+                term_positions.append(positions)
+                self.contents_size += sys.getsizeof(term_positions) - size_before + sys.getsizeof(positions)
+
+    def items(self):
+        '''
+        (term, posting list) pairs, positional if positions were added
+        '''
+        for term, doc_ids in self.postings.items():
+            if term in self.positions:
+                yield term, PositionalPostingList(doc_ids, self.positions[term])
+            else:
+                yield term, PostingList(doc_ids)
+
+    def clear(self):
+        self.postings = {}
+        self.positions = {}
+        self.contents_size = 0
+
+    def __len__(self):
+        return len(self.postings)
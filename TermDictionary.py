@@ -0,0 +1,199 @@
+import mmap
+import os
+import pickle
+import struct
+import sys
+from bisect import bisect_left, bisect_right
+
+from Compression import vb_decode, vb_encode_number
+
+# term dictionary files start with this line so they can be told apart from pickled dictionaries
+MAGIC = b"FCDICT1\n"
+
+# terms are front coded in blocks of this many terms, the first of each stored in full
+BLOCK_SIZE = 16
+# decoded blocks kept by a dictionary, so lookups of the same terms do not decode their block again
+# (a plain dictionary emptied when full, which is cheaper to probe on every lookup than an LRU cache)
+BLOCK_CACHE_BLOCKS = 4096
+
+# term count, block size, then the offsets of the df array, the pointer array, the block offsets and the terms
+HEADER = struct.Struct('<IIQQQQ')
+DF = struct.Struct('<I')
+POINTER = struct.Struct('<Q')
+
+
+def write_term_dictionary(path, dictionary, block_size = BLOCK_SIZE):
+    '''
+    writes a dictionary of term to (df, pointer) as sorted, blocked front coded terms with fixed-width
+    df and pointer arrays in term order and the byte offset of every block, so it can be searched in place
+    every term of a block after the first is (length of the prefix shared with the previous term,
+    length of the rest, rest of the term), with lengths variable byte encoded
+    '''
+    terms = sorted(term.encode() for term in dictionary)
+    blocks = bytearray()
+    block_offsets = []
+    previous = b""
+    for i, term in enumerate(terms):
+        if i % block_size == 0:
+            block_offsets.append(len(blocks))
+            prefix = 0
+        else:
+            prefix = len(os.path.commonprefix([previous, term]))
+            vb_encode_number(prefix, blocks)
+        vb_encode_number(len(term) - prefix, blocks)
+        blocks.extend(term[prefix:])
+        previous = term
+
+    df_offset = len(MAGIC) + HEADER.size
+    pointer_offset = df_offset + DF.size * len(terms)
+    block_offsets_offset = pointer_offset + POINTER.size * len(terms)
+    terms_offset = block_offsets_offset + POINTER.size * len(block_offsets)
+    # written next to the old file and swapped in, so searches that mapped the old file can keep reading it
+    with open(path + ".tmp", 'wb') as f:
+        f.write(MAGIC)
+        f.write(HEADER.pack(len(terms), block_size, df_offset, pointer_offset, block_offsets_offset, terms_offset))
+        for term in terms:
+            f.write(DF.pack(dictionary[term.decode()][0]))
+        for term in terms:
+            f.write(POINTER.pack(dictionary[term.decode()][1]))
+        for offset in block_offsets:
+            f.write(POINTER.pack(offset))
+        f.write(blocks)
+    os.replace(path + ".tmp", path)
+
+
+def load_term_dictionary(path):
+    '''
+    opens a term dictionary file in place, or loads an older pickled dictionary
+    '''
+    with open(path, 'rb') as f:
+        if f.read(len(MAGIC)) != MAGIC:
+            f.seek(0)
+            return pickle.load(f)
+    return TermDictionary(path)
+
+
+class TermDictionary:
+    '''
+    read-only mapping of term to (df, pointer) over a memory-mapped term dictionary file
+    the first term of every block is decoded when the file is opened, and a lookup is a binary search over them
+    followed by a binary search of one decoded block; only those first terms and a bounded cache of
+    decoded blocks are kept in memory, so the dictionary is never materialized
+    '''
+    def __init__(self, path):
+        self.file = open(path, 'rb')
+        self.buffer = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+        (self.count, self.block_size, self.df_offset, self.pointer_offset, self.block_offsets_offset,
+         self.terms_offset) = HEADER.unpack_from(self.buffer, len(MAGIC))
+        self.block_count = (self.count + self.block_size - 1) // self.block_size
+        self.leaders = [self.first_term(block) for block in range(self.block_count)]
+        self.blocks = {}
+        # the little-endian df and pointer arrays are read in place where that is the native byte order
+        self.dfs = self.pointers = None
+        if sys.byteorder == 'little' and self.count:
+            view = memoryview(self.buffer)
+            self.dfs = view[self.df_offset:self.pointer_offset].cast('I')
+            self.pointers = view[self.pointer_offset:self.block_offsets_offset].cast('Q')
+            view.release()
+
+    def block_start(self, block):
+        return self.terms_offset + POINTER.unpack_from(self.buffer, self.block_offsets_offset + POINTER.size * block)[0]
+
+    def first_term(self, block):
+        position = self.block_start(block)
+        (length,), position = vb_decode(self.buffer, position, 1)
+        return self.buffer[position:position + length]
+
+    def iter_block(self, block):
+        '''
+        yields (index, term as bytes) for every term of a block
+        '''
+        position = self.block_start(block)
+        first = block * self.block_size
+        term = b""
+        for index in range(first, min(first + self.block_size, self.count)):
+            if index == first:
+                prefix = 0
+                (length,), position = vb_decode(self.buffer, position, 1)
+            else:
+                (prefix, length), position = vb_decode(self.buffer, position, 2)
+            term = term[:prefix] + self.buffer[position:position + length]
+            position += length
+            yield index, term
+
+    def block_terms(self, block):
+        '''
+        the sorted terms of a block as bytes, decoded once while the block stays in the cache
+        '''
+        terms = self.blocks.get(block)
+        if terms is None:
+            terms = [term for _, term in self.iter_block(block)]
+            if len(self.blocks) >= BLOCK_CACHE_BLOCKS:
+                self.blocks.clear()
+            self.blocks[block] = terms
+        return terms
+
+    def find(self, term):
+        '''
+        index of a term, or -1 if it is not in the dictionary
+        '''
+        key = term.encode()
+        # last block whose first term is <= key
+        block = bisect_right(self.leaders, key) - 1
+        if block < 0:
+            return -1
+        terms = self.block_terms(block)
+        i = bisect_left(terms, key)
+        if i < len(terms) and terms[i] == key:
+            return block * self.block_size + i
+        return -1
+
+    def term(self, index):
+        '''
+        the term at an index of the sorted terms
+        '''
+        if not 0 <= index < self.count:
+            raise IndexError(index)
+        return self.block_terms(index // self.block_size)[index % self.block_size].decode()
+
+    def entry(self, index):
+        if self.dfs is not None:
+            return self.dfs[index], self.pointers[index]
+        return (DF.unpack_from(self.buffer, self.df_offset + DF.size * index)[0],
+                POINTER.unpack_from(self.buffer, self.pointer_offset + POINTER.size * index)[0])
+
+    def get(self, term, default = None):
+        index = self.find(term)
+        return default if index == -1 else self.entry(index)
+
+    def __getitem__(self, term):
+        index = self.find(term)
+        if index == -1:
+            raise KeyError(term)
+        return self.entry(index)
+
+    def __contains__(self, term):
+        return self.find(term) != -1
+
+    def __iter__(self):
+        for block in range(self.block_count):
+            for _, term in self.iter_block(block):
+                yield term.decode()
+
+    def keys(self):
+        return iter(self)
+
+    def items(self):
+        for block in range(self.block_count):
+            for index, term in self.iter_block(block):
+                yield term.decode(), self.entry(index)
+
+    def __len__(self):
+        return self.count
+
+    def close(self):
+        if self.dfs is not None:
+            self.dfs.release()
+            self.pointers.release()
+        self.buffer.close()
+        self.file.close()
@@ -0,0 +1,707 @@
+#!/usr/bin/python3
+import getopt
+import os
+import pickle
+import random
+import re
+import shutil
+import socket
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+from array import array
+
+import index
+from Compression import MAGIC, encode_posting
+from InputBuffer import InputBuffer
+from KGramIndex import WILDCARD, expand_wildcard, is_wildcard, kgram_index_path
+from OutputBuffer import OutputBuffer
+from PositionalIndex import is_phrase, phrase_intersection, phrase_terms
+from PostingList import INTERSECTION_ALGORITHMS, PostingList, choose_intersection
+from Postings import Postings
+from QueryParser import ENGINES
+from Ranker import PRUNING, Ranker
+from search import load_query_parser
+from server import QueryServer
+from SkipLinkedList import SkipLinkedList
+from TermDictionary import TermDictionary, load_term_dictionary, write_term_dictionary
+
+
+def usage():
+    print("usage: " + sys.argv[0] + " -b benchmark [-d dictionary-file] [-p postings-file] [-n blocks-or-rounds] "
+          "[-q file-of-queries] [-c clients] [-r requests] [-a host:port] [-i directory-of-documents]")
+    for name, (_, required) in BENCHMARKS.items():
+        print(f"  {name} (requires {', '.join(map(describe_requirement, required)) if required else 'nothing'})")
+
+
+def requirement_met(options, requirement):
+    '''
+    a requirement is an option, or a list of alternatives that are each a list of options given together
+    '''
+    if isinstance(requirement, str):
+        return requirement in options
+    return any(all(option in options for option in alternative) for alternative in requirement)
+
+
+def describe_requirement(requirement):
+    if isinstance(requirement, str):
+        return requirement
+    return " or ".join(" ".join(alternative) for alternative in requirement)
+
+
+def load_dictionary(dict_file):
+    return load_term_dictionary(dict_file)
+
+
+def time_all_postings(postings, terms):
+    '''
+    reads and decodes the posting of every term, returns (seconds, total doc ids decoded)
+    '''
+    total = 0
+    start = time.perf_counter()
+    for term in terms:
+        total += postings.get_posting(term).length
+    return time.perf_counter() - start, total
+
+
+def write_binary_postings(dictionary, text_postings, out_postings):
+    '''
+    re-encodes a text postings file into the binary format, returns the binary dictionary
+    '''
+    binary_dictionary = {}
+    with open(out_postings, 'wb') as f:
+        f.write(MAGIC)
+        for term in sorted(dictionary):
+            doc_ids = text_postings.get_posting(term).doc_ids
+            binary_dictionary[term] = (len(doc_ids), f.tell())
+            f.write(encode_posting(doc_ids))
+    return binary_dictionary
+
+
+def benchmark_postings_format(options):
+    '''
+    compares index size and decode throughput of the text and binary postings formats
+    '''
+    dict_file, postings_file = options['-d'], options['-p']
+    dictionary = load_dictionary(dict_file)
+    terms = sorted(dictionary)
+    text_postings = Postings(postings_file, dictionary)
+    with tempfile.TemporaryDirectory() as directory:
+        binary_file = os.path.join(directory, "postings.bin")
+        binary_dictionary = write_binary_postings(dictionary, text_postings, binary_file)
+        binary_postings = Postings(binary_file, binary_dictionary)
+
+        results = []
+        for name, postings, path in [("text", text_postings, postings_file),
+                                     ("binary", binary_postings, binary_file)]:
+            seconds, total = time_all_postings(postings, terms)
+            results.append((name, os.path.getsize(path), seconds, total))
+        binary_postings.close()
+    text_postings.close()
+
+    print(f"{'format':<8} {'size (bytes)':>14} {'decode (s)':>11} {'doc ids/s':>14}")
+    for name, size, seconds, total in results:
+        print(f"{name:<8} {size:>14} {seconds:>11.3f} {total / seconds:>14.0f}")
+    text_size, binary_size = results[0][1], results[1][1]
+    print(f"binary postings are {binary_size / text_size:.1%} of the text size, "
+          f"decoded {results[0][2] / results[1][2]:.2f}x as fast")
+
+
+def write_synthetic_blocks(directory, blocks, terms_per_block, docs_per_block):
+    '''
+    writes SPIMI-like temp files: each block covers its own doc id range and a random sorted subset of terms
+    '''
+    random.seed(0)
+    vocabulary = [f"term{i:07d}" for i in range(terms_per_block * 4)]
+    for block in range(blocks):
+        first_doc_id = block * docs_per_block
+        with open(os.path.join(directory, str(block)), 'w') as f:
+            for term in sorted(random.sample(vocabulary, terms_per_block)):
+                doc_ids = random.sample(range(first_doc_id, first_doc_id + docs_per_block), random.randint(1, 20))
+                f.write(f"{term} {PostingList(sorted(doc_ids))}\n")
+
+
+def linear_scan_merge(files, next_directory, memory_limit):
+    '''
+    the previous n_way_merge, which rescans every input with min() for each output term
+    postings of a term are combined before reaching the output buffer, as in n_way_merge, so that a flush
+    of the buffer never splits a term over two lines and both merges write the same postings
+    memory_limit is split between the buffers as in n_way_merge, so both merges are compared on the same budget
+    '''
+    buffer_size = memory_limit // (len(files) + 1)
+    index.ensure_directory_exists(next_directory)
+    temp_path = os.path.join(next_directory, str(index.get_write_index(next_directory)))
+    with open(temp_path, 'a+') as f:
+        output = OutputBuffer(f, buffer_size)
+        inputs = [InputBuffer(open(file, 'r'), buffer_size) for file in files]
+        current_term = current_posting = None
+        while not all(input.is_file_empty() for input in inputs):
+            valid_inputs = [(input.peek_next_term(), input) for input in inputs if input.peek_next_term() is not None]
+            minimum_index = min(range(len(valid_inputs)), key=lambda i: valid_inputs[i][0])
+            term, posting = valid_inputs[minimum_index][1].pop_next_posting()
+            if term == current_term:
+                current_posting = current_posting.merge(posting)
+                continue
+            if current_term is not None:
+                output.insert((current_term, current_posting))
+            current_term, current_posting = term, posting
+        if current_term is not None:
+            output.insert((current_term, current_posting))
+        for input in inputs:
+            input.close()
+        output.flush()
+
+
+def linear_scan_merge_postings(n, memory_limit):
+    '''
+    the previous merge_postings, including its grouping of n + 1 files in the first merge of each pass
+    '''
+    current_directory = "temp"
+    next_directory = os.path.join(current_directory, "temp")
+    while len(os.listdir(current_directory)) > 1:
+        dir = sorted(os.listdir(current_directory), key=int)
+        index.ensure_directory_exists(next_directory)
+        files = []
+        for i, file in enumerate(dir):
+            files.append(os.path.join(current_directory, file))
+            if i % n == 0 and i != 0:
+                linear_scan_merge(files, next_directory, memory_limit)
+                files = []
+        if files:
+            linear_scan_merge(files, next_directory, memory_limit)
+        current_directory = next_directory
+        next_directory = os.path.join(current_directory, "temp")
+    shutil.move(os.path.join(current_directory, "0"), "postings_temp")
+
+
+def bytes_written_by_merge():
+    '''
+    total size of the intermediate merge files and the merged postings, excluding the original blocks
+    '''
+    total = os.path.getsize("postings_temp")
+    for directory, _, files in os.walk(os.path.join("temp", "temp")):
+        total += sum(os.path.getsize(os.path.join(directory, file)) for file in files)
+    return total
+
+
+def benchmark_merge(options):
+    '''
+    compares the heap merge at a wide fan-in with the previous linear scan merge at a fan-in of 3,
+    all with the default merge memory of index.py
+    '''
+    blocks = int(options.get('-n', 200))
+    memory_limit = index.DEFAULT_BLOCK_MEMORY
+    working_directory = os.getcwd()
+    with tempfile.TemporaryDirectory() as directory:
+        blocks_directory = os.path.join(directory, "blocks")
+        os.makedirs(blocks_directory)
+        write_synthetic_blocks(blocks_directory, blocks, 2000, 100)
+        os.chdir(directory)
+        try:
+            results = []
+            for name, merge in [("linear scan, fan-in 3", lambda: linear_scan_merge_postings(3, memory_limit)),
+                                ("heap, fan-in 64", lambda: index.merge_postings(64, None, memory_limit)),
+                                ("heap, fan-in 256", lambda: index.merge_postings(256, None, memory_limit))]:
+                shutil.copytree(blocks_directory, "temp")
+                start = time.perf_counter()
+                merge()
+                seconds = time.perf_counter() - start
+                written = bytes_written_by_merge()
+                with open("postings_temp") as f:
+                    output = f.read()
+                results.append((name, seconds, written, output))
+                shutil.rmtree("temp")
+                os.remove("postings_temp")
+        finally:
+            os.chdir(working_directory)
+
+    print(f"\n{blocks} blocks")
+    print(f"{'merge':<24} {'time (s)':>9} {'bytes written':>14}")
+    for name, seconds, written, output in results:
+        print(f"{name:<24} {seconds:>9.3f} {written:>14}")
+        assert output == results[0][3], f"{name} produced different postings"
+
+
+def percentile(sorted_values, fraction):
+    return sorted_values[min(len(sorted_values) - 1, int(fraction * len(sorted_values)))]
+
+
+def run_client(address, queries, requests, latencies):
+    '''
+    sends requests queries one at a time over a single connection, recording each round trip time
+    '''
+    with socket.create_connection(address) as connection:
+        reader = connection.makefile('rb')
+        for i in range(requests):
+            query = queries[i % len(queries)]
+            start = time.perf_counter()
+            connection.sendall(f"{query}\n".encode())
+            reader.readline()
+            latencies.append(time.perf_counter() - start)
+
+
+def benchmark_server(options):
+    '''
+    local load generator for server.py: concurrent clients replaying a query file
+    reports throughput and p50/p99 latency
+    starts a server over -d/-p in this process unless the address of a running one is given with -a
+    '''
+    with open(options['-q']) as f:
+        queries = [line.strip() for line in f]
+    clients = int(options.get('-c', 8))
+    requests = int(options.get('-r', 2000))
+    server = None
+    if '-a' in options:
+        host, port = options['-a'].rsplit(":", 1)
+        address = (host, int(port))
+    else:
+        server = QueryServer(("127.0.0.1", 0), load_query_parser(options['-d'], options['-p'], mapped=True))
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        address = server.server_address
+
+    latencies = []
+    threads = [threading.Thread(target=run_client, args=(address, queries[i:] + queries[:i], requests // clients, latencies))
+               for i in range(clients)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    seconds = time.perf_counter() - start
+    if server:
+        server.shutdown()
+        server.server_close()
+
+    latencies.sort()
+    print(f"{len(latencies)} queries from {clients} clients in {seconds:.2f}s ({len(latencies) / seconds:.0f} queries/s)")
+    print(f"latency p50 {percentile(latencies, 0.5) * 1000:.2f}ms, p99 {percentile(latencies, 0.99) * 1000:.2f}ms, "
+          f"max {latencies[-1] * 1000:.2f}ms")
+
+
+def evaluate_unplanned(query_parser, query):
+    '''
+    evaluates a query in RPN as written, one binary operator at a time with skip-based intersections
+    '''
+    stack = []
+    for term in query:
+        if term == 'NOT':
+            stack.append(query_parser.NOT(stack.pop()))
+        elif term in ('AND', 'OR'):
+            right, left = stack.pop(), stack.pop()
+            stack.append(query_parser.AND(left, right, 'skip') if term == 'AND' else query_parser.OR(left, right))
+        else:
+            stack.append(query_parser.postings.get_posting(term))
+    return stack.pop()
+
+
+def load_boolean_queries(query_parser, path):
+    '''
+    (query, postfix) of the valid queries of a file that only have terms and boolean operators
+    queries with phrases or wildcards are left out, since evaluating as written and the linked list engine
+    only read the posting of each term
+    '''
+    queries = []
+    skipped = 0
+    with open(path) as f:
+        for line in f:
+            try:
+                query_parser.plan_query(line)
+                postfix = query_parser.parse_query(line)
+            except ValueError:
+                continue
+            if any(is_phrase(term) or is_wildcard(term) for term in postfix):
+                skipped += 1
+                continue
+            queries.append((line.strip(), postfix))
+    if skipped:
+        print(f"skipping {skipped} queries with phrases or wildcards")
+    return queries
+
+
+def time_queries(evaluate, queries, rounds):
+    '''
+    evaluates every query rounds times, returns the fastest time of each query and its results
+    '''
+    times = []
+    results = []
+    for query in queries:
+        best = None
+        for _ in range(rounds):
+            start = time.perf_counter()
+            result = evaluate(query).get_value_string()
+            seconds = time.perf_counter() - start
+            best = seconds if best is None else min(best, seconds)
+        times.append(best)
+        results.append(result)
+    return times, results
+
+
+def benchmark_plan(options):
+    '''
+    compares evaluating the boolean queries of -q as written with evaluating their plans
+    '''
+    query_parser = load_query_parser(options['-d'], options['-p'])
+    rounds = int(options.get('-n', 10))
+    queries = load_boolean_queries(query_parser, options['-q'])
+
+    unplanned_times, unplanned_results = time_queries(lambda postfix: evaluate_unplanned(query_parser, postfix),
+                                                      [postfix for _, postfix in queries], rounds)
+    planned_times, planned_results = time_queries(lambda postfix: query_parser.evaluate_query(postfix),
+                                                  [postfix for _, postfix in queries], rounds)
+
+    print(f"{'query':<60} {'as written (ms)':>16} {'planned (ms)':>13} {'speedup':>8}")
+    for (query, _), unplanned, planned in zip(queries, unplanned_times, planned_times):
+        print(f"{query[:60]:<60} {unplanned * 1000:>16.3f} {planned * 1000:>13.3f} {unplanned / planned:>7.2f}x")
+    for (query, _), unplanned, planned in zip(queries, unplanned_results, planned_results):
+        assert unplanned == planned, f"planned evaluation of {query} produced different results"
+    print(f"{len(queries)} queries: {sum(unplanned_times) * 1000:.2f}ms as written, "
+          f"{sum(planned_times) * 1000:.2f}ms planned ({sum(unplanned_times) / sum(planned_times):.2f}x)")
+
+
+def synthetic_posting(length, universe, rng):
+    return PostingList(array('I', sorted(rng.sample(range(universe), length))))
+
+
+def best_time(function, rounds):
+    best = None
+    for _ in range(rounds):
+        start = time.perf_counter()
+        function()
+        seconds = time.perf_counter() - start
+        best = seconds if best is None else min(best, seconds)
+    return best
+
+
+def benchmark_intersection(options):
+    '''
+    times each intersection algorithm on synthetic postings over a range of length ratios,
+    and the multi-way intersection of k lists against pairwise intersections from the shortest up
+    '''
+    rng = random.Random(0)
+    rounds = int(options.get('-n', 5))
+    universe = 2000000
+    long_length = 200000
+    algorithms = INTERSECTION_ALGORITHMS + (None,)
+    long_list = synthetic_posting(long_length, universe, rng)
+
+    print(f"{'skew':>6} {'short':>7} " + " ".join(f"{algorithm or 'chosen':>10}" for algorithm in algorithms)
+          + "   (ms)")
+    for skew in (1, 10, 100, 1000, 10000):
+        short_list = synthetic_posting(long_length // skew, universe, rng)
+        times = [best_time(lambda: short_list.AND(long_list, algorithm), rounds) for algorithm in algorithms]
+        chosen = choose_intersection(short_list.length, long_list.length)
+        print(f"{skew:>6} {short_list.length:>7} " + " ".join(f"{seconds * 1000:>10.3f}" for seconds in times)
+              + f"   chose {chosen}")
+
+    print(f"\n{'k':>3} {'lengths':<40} {'pairwise (ms)':>14} {'multi-way (ms)':>15}")
+    for lengths in ([200, 20000, 200000], [2000, 20000, 100000, 200000], [200, 2000, 20000, 100000, 200000],
+                    [50000, 100000, 150000, 200000]):
+        lists = [synthetic_posting(length, universe, rng) for length in lengths]
+
+        def pairwise():
+            result = lists[0]
+            for posting_list in lists[1:]:
+                result = result.AND(posting_list)
+            return result
+
+        assert pairwise().doc_ids == PostingList.AND_all(lists).doc_ids
+        print(f"{len(lists):>3} {' '.join(map(str, lengths)):<40} {best_time(pairwise, rounds) * 1000:>14.3f} "
+              f"{best_time(lambda: PostingList.AND_all(lists), rounds) * 1000:>15.3f}")
+
+
+def evaluate_linked_lists(postings, full_list, query):
+    '''
+    evaluates a query in RPN as written on SkipLinkedLists, the engine the index started out with
+    '''
+    stack = []
+    for term in query:
+        if term == 'NOT':
+            stack.append(full_list.NOT(stack.pop()))
+        elif term in ('AND', 'OR'):
+            right, left = stack.pop(), stack.pop()
+            stack.append(left.AND(right) if term == 'AND' else left.OR(right))
+        else:
+            stack.append(postings[term])
+    return stack.pop()
+
+
+def benchmark_engine(options):
+    '''
+    compares the SkipLinkedList engine with the array and numpy engines of QueryParser, on the boolean queries of -q
+    '''
+    rounds = int(options.get('-n', 10))
+    engines = {}
+    for engine in ENGINES:
+        try:
+            engines[engine] = load_query_parser(options['-d'], options['-p'], engine=engine)
+        except ImportError as e:
+            print(f"skipping the {engine} engine: {e}")
+    query_parser = engines['array']
+    queries = load_boolean_queries(query_parser, options['-q'])
+    # postings are converted to linked lists up front, as the linked list engine read them from text postings
+    terms = {term for _, postfix in queries for term in postfix if term not in query_parser.operators}
+    linked_postings = {term: SkipLinkedList(str(query_parser.postings.get_posting(term))) for term in terms}
+    linked_full_list = SkipLinkedList(str(query_parser.full_list))
+
+    postfixes = [postfix for _, postfix in queries]
+    results = {'linked list': time_queries(lambda postfix: evaluate_linked_lists(linked_postings, linked_full_list,
+                                                                                 postfix), postfixes, rounds)}
+    for engine, parser in engines.items():
+        results[engine] = time_queries(lambda postfix: parser.evaluate_query(postfix), postfixes, rounds)
+
+    print(f"{'query':<50} " + " ".join(f"{name + ' (ms)':>16}" for name in results))
+    for i, (query, _) in enumerate(queries):
+        print(f"{query[:50]:<50} " + " ".join(f"{times[i] * 1000:>16.3f}" for times, _ in results.values()))
+        for name, (_, engine_results) in results.items():
+            assert engine_results[i] == results['linked list'][1][i], f"{name} engine produced different results for {query}"
+    print(f"{len(queries)} queries: " + ", ".join(f"{sum(times) * 1000:.2f}ms {name}" for name, (times, _) in results.items()))
+
+
+def benchmark_dictionary(options):
+    '''
+    compares a pickled dictionary with a front coded term dictionary file: size, time to open and first lookup,
+    memory allocated when opened, and lookup throughput
+    '''
+    dictionary = dict(load_dictionary(options['-d']).items())
+    terms = list(dictionary)
+    random.seed(0)
+    lookups = [random.choice(terms) for _ in range(100000)] if terms else []
+    with tempfile.TemporaryDirectory() as directory:
+        pickled_file = os.path.join(directory, "dictionary.pickle")
+        with open(pickled_file, 'wb') as f:
+            pickle.dump(dictionary, f, protocol=pickle.HIGHEST_PROTOCOL)
+        front_coded_file = os.path.join(directory, "dictionary.fc")
+        write_term_dictionary(front_coded_file, dictionary)
+
+        results = []
+        for name, path in [("pickle", pickled_file), ("front coded", front_coded_file)]:
+            tracemalloc.start()
+            start = time.perf_counter()
+            loaded = load_term_dictionary(path)
+            if terms:
+                loaded.get(terms[0])
+            open_seconds = time.perf_counter() - start
+            allocated = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+            start = time.perf_counter()
+            for term in lookups:
+                loaded.get(term)
+            lookup_seconds = time.perf_counter() - start
+            results.append((name, os.path.getsize(path), open_seconds, allocated, lookup_seconds))
+            if isinstance(loaded, TermDictionary):
+                loaded.close()
+            # freed here rather than when the next dictionary is assigned, inside its timing
+            del loaded
+
+    print(f"{len(terms)} terms")
+    print(f"{'dictionary':<12} {'size (bytes)':>13} {'open (ms)':>10} {'allocated':>12} {'lookups/s':>11}")
+    for name, size, open_seconds, allocated, lookup_seconds in results:
+        print(f"{name:<12} {size:>13} {open_seconds * 1000:>10.2f} {allocated:>12} "
+              f"{len(lookups) / lookup_seconds if lookup_seconds else 0:>11.0f}")
+
+
+def benchmark_wildcard(options):
+    '''
+    expands wildcard patterns made from random terms of the dictionary with its k-gram index and by scanning
+    every term, then unions the postings of the expanded terms pairwise and with one k-way union
+    '''
+    rounds = int(options.get('-n', 5))
+    postings = load_query_parser(options['-d'], options['-p']).postings
+    if postings.kgram_index is None:
+        print(f"{kgram_index_path(options['-d'])} not found, rebuild the index to write it")
+        return
+    rng = random.Random(0)
+    terms = list(postings.dictionary)
+    samples = rng.sample(terms, min(20, len(terms)))
+    patterns = sorted({term[:length] + WILDCARD for term in samples for length in (2, 4)} |
+                      {WILDCARD + term[-3:] for term in samples})
+
+    print(f"{'pattern':<16} {'terms':>6} {'k-gram (ms)':>12} {'scan (ms)':>10} {'pairwise (ms)':>14} {'k-way (ms)':>11}")
+    totals = [0.0] * 4
+    for pattern in patterns:
+        expanded = postings.expand(pattern)
+        assert expanded == expand_wildcard(pattern, postings.dictionary), f"k-gram expansion of {pattern} missed terms"
+        posting_lists = [postings.get_posting(term) for term in expanded]
+
+        def pairwise():
+            result = PostingList()
+            for posting_list in posting_lists:
+                result = result.OR(posting_list)
+            return result
+
+        assert list(pairwise()) == list(PostingList.OR_all(posting_lists))
+        times = [best_time(lambda: postings.expand(pattern), rounds),
+                 best_time(lambda: expand_wildcard(pattern, postings.dictionary), rounds),
+                 best_time(pairwise, rounds), best_time(lambda: PostingList.OR_all(posting_lists), rounds)]
+        totals = [total + seconds for total, seconds in zip(totals, times)]
+        print(f"{pattern:<16} {len(expanded):>6} " +
+              " ".join(f"{seconds * 1000:>{width}.3f}" for seconds, width in zip(times, (12, 10, 14, 11))))
+    print(f"{len(patterns)} patterns: expansion {totals[0] * 1000:.2f}ms with k-grams, {totals[1] * 1000:.2f}ms scanning; "
+          f"union {totals[2] * 1000:.2f}ms pairwise, {totals[3] * 1000:.2f}ms k-way")
+
+
+def positional_intersection(phrase, get_positions):
+    '''
+    positional intersection that decodes the positions of every document of every term of a phrase
+    '''
+    starts = None
+    for offset, term in enumerate(phrase):
+        term_starts = {doc_id: {position - offset for position in positions}
+                       for doc_id, positions in get_positions(term)}
+        if starts is None:
+            starts = term_starts
+        else:
+            starts = {doc_id: doc_starts & term_starts[doc_id] for doc_id, doc_starts in starts.items()
+                      if doc_id in term_starts and doc_starts & term_starts[doc_id]}
+    return array('I', sorted(starts))
+
+
+def benchmark_phrase(options):
+    '''
+    evaluates the quoted phrases of the queries by decoding all the positions of their terms,
+    and as QueryParser does, by reading positions only for the documents of the intersection of their postings
+    '''
+    rounds = int(options.get('-n', 5))
+    query_parser = load_query_parser(options['-d'], options['-p'])
+    postings = query_parser.postings
+    if not postings.has_positions():
+        print(f"{options['-p']} has no positions, rebuild the index with --positions")
+        return
+    phrases = []
+    with open(options['-q']) as f:
+        for line in f:
+            for phrase in re.findall(r'"[^"]*"', line):
+                terms = phrase_terms(query_parser.normalize_phrase(phrase))
+                if len(terms) > 1 and terms not in phrases:
+                    phrases.append(terms)
+
+    print(f"{'phrase':<40} {'matches':>8} {'all positions (ms)':>19} {'skipping (ms)':>14}")
+    totals = [0.0, 0.0]
+    for terms in phrases:
+        def skipping():
+            candidates = PostingList.AND_all([postings.get_posting(term) for term in terms])
+            if not candidates.length:
+                return candidates.doc_ids
+            phrase = sorted(enumerate(terms), key=lambda entry: postings.get_df(entry[1]))
+            return phrase_intersection(phrase, list(candidates), postings.get_positions)
+
+        matches = skipping()
+        assert list(matches) == list(positional_intersection(terms, postings.get_positions)), \
+            f"positions of {' '.join(terms)} gave different results"
+        times = [best_time(lambda: positional_intersection(terms, postings.get_positions), rounds),
+                 best_time(skipping, rounds)]
+        totals = [total + seconds for total, seconds in zip(totals, times)]
+        print(f"{' '.join(terms)[:40]:<40} {len(matches):>8} {times[0] * 1000:>19.3f} {times[1] * 1000:>14.3f}")
+    print(f"{len(phrases)} phrases: {totals[0] * 1000:.2f}ms decoding all positions, {totals[1] * 1000:.2f}ms skipping")
+
+
+def benchmark_rank(options):
+    '''
+    ranks the top 10 documents of each query by bm25, scoring every matching document and pruning with each strategy
+    '''
+    rounds = int(options.get('-n', 5))
+    query_parser = load_query_parser(options['-d'], options['-p'])
+    postings = query_parser.postings
+    if not postings.has_frequencies():
+        print(f"{options['-p']} has no term frequencies, rebuild the index with --frequencies")
+        return
+    ranker = Ranker(postings)
+    queries = []
+    with open(options['-q']) as f:
+        for line in f:
+            terms = [query_parser.normalize_word(word) for word in re.findall(r'[^\s()"]+', line)
+                     if word not in query_parser.operators]
+            if terms:
+                queries.append(terms)
+
+    print(f"{'query':<30} " + " ".join(f"{pruning + ' (ms)':>15} {'scored':>7}" for pruning in PRUNING))
+    totals = {pruning: [0.0, 0] for pruning in PRUNING}
+    for terms in queries:
+        expected = ranker.rank(terms, 10, 'none')
+        row = []
+        for pruning in PRUNING:
+            stats = {}
+            assert ranker.rank(terms, 10, pruning, stats) == expected, f"{pruning} ranked {' '.join(terms)} differently"
+            scored = stats['scored_documents']
+            seconds = best_time(lambda: ranker.rank(terms, 10, pruning), rounds)
+            totals[pruning][0] += seconds
+            totals[pruning][1] += scored
+            row.append(f"{seconds * 1000:>15.3f} {scored:>7}")
+        print(f"{' '.join(terms)[:30]:<30} " + " ".join(row))
+    print(f"{len(queries)} queries: " + ", ".join(f"{pruning} {seconds * 1000:.2f}ms ({scored} documents scored)"
+                                             for pruning, (seconds, scored) in totals.items()))
+
+
+def benchmark_tokenize(options):
+    '''
+    tokenizes the documents of a directory the old way (whole file read, then split into sentences and words)
+    and with the streaming pipeline of index.py, with and without its sentence stage
+    reports throughput per core (one process) and the peak memory of tokenizing the largest document
+    '''
+    rounds = int(options.get('-n', 3))
+    in_dir = options['-i']
+    filenames = [os.path.join(in_dir, file) for file in sorted(os.listdir(in_dir), key=int)]
+    total_bytes = sum(os.path.getsize(filename) for filename in filenames)
+    largest = max(filenames, key=os.path.getsize)
+
+    def read_whole(filename):
+        with open(filename) as f:
+            return index.tokenize(index.normalizer.normalize(word) for sentence in index.sent_tokenize(f.read())
+                                  for word in index.word_tokenize(sentence))
+
+    def streamed(sentences):
+        def tokenize(filename):
+            with open(filename) as f:
+                return index.tokenize(index.stream_terms(f, index.normalizer, sentences))
+        return tokenize
+
+    tokenizers = {'whole file': read_whole, 'streamed': streamed(True), 'streamed, no sentences': streamed(False)}
+    print(f"{len(filenames)} documents, {total_bytes / 1e6:.1f} MB, largest {os.path.getsize(largest) / 1e6:.1f} MB")
+    print(f"{'tokenizer':<24} {'MB/s per core':>14} {'peak memory (MB)':>17}")
+    for name, tokenize in tokenizers.items():
+        seconds = best_time(lambda: [tokenize(filename) for filename in filenames], rounds)
+        tracemalloc.start()
+        tokenize(largest)
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        print(f"{name:<24} {total_bytes / 1e6 / seconds:>14.2f} {peak / 1e6:>17.1f}")
+
+
+BENCHMARKS = {
+    'postings-format': (benchmark_postings_format, ['-d', '-p']),
+    'merge': (benchmark_merge, []),
+    'server': (benchmark_server, ['-q', [['-a'], ['-d', '-p']]]),
+    'plan': (benchmark_plan, ['-d', '-p', '-q']),
+    'intersection': (benchmark_intersection, []),
+    'engine': (benchmark_engine, ['-d', '-p', '-q']),
+    'dictionary': (benchmark_dictionary, ['-d']),
+    'wildcard': (benchmark_wildcard, ['-d', '-p']),
+    'phrase': (benchmark_phrase, ['-d', '-p', '-q']),
+    'rank': (benchmark_rank, ['-d', '-p', '-q']),
+    'tokenize': (benchmark_tokenize, ['-i']),
+}
+
+if __name__ == '__main__':
+    benchmark = None
+    options = {}
+
+    try:
+        opts, args = getopt.getopt(sys.argv[1:], 'b:d:p:n:q:c:r:a:i:')
+    except getopt.GetoptError:
+        usage()
+        sys.exit(2)
+
+    for o, a in opts:
+        if o == '-b':
+            benchmark = a
+        else:
+            options[o] = a
+
+    if benchmark not in BENCHMARKS or not all(requirement_met(options, requirement)
+                                              for requirement in BENCHMARKS[benchmark][1]):
+        usage()
+        sys.exit(2)
+
+    BENCHMARKS[benchmark][0](options)
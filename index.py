@@ -1,40 +1,182 @@
 #!/usr/bin/python3
 import math
+import multiprocessing
 import os
 import re
 import nltk
 import shutil
 import sys
 import getopt
+import heapq
 import pickle
+import tempfile
+import time
+from array import array
 
 import linecache
 
 from nltk.tokenize import word_tokenize
 from nltk.tokenize import sent_tokenize
 from nltk.stem import PorterStemmer
+from Compression import MAGIC, encode_frequencies, encode_positions, encode_record
 from InputBuffer import InputBuffer
+from KGramIndex import kgram_index_path, write_kgram_index
+from Normalizer import Normalizer, stem_cache_path
+from SpimiBlock import SpimiBlock
+from TermDictionary import load_term_dictionary, write_term_dictionary
 from OutputBuffer import OutputBuffer
-from SkipLinkedList import SkipLinkedList
+from PositionalIndex import (FREQUENCIES_MAGIC, RecordsWriter, TermFrequencies, document_lengths_path,
+                             frequencies_path, load_document_lengths, load_positional_index, positions_path,
+                             write_document_lengths)
+from PostingList import PositionalPostingList, PostingList, parse_posting
+from Postings import Postings
+from SegmentedPostings import (DICTIONARY_FILE, FULL_LIST_FILE, POSTINGS_FILE, ManifestLock, create_segment,
+                               load_dictionary, load_full_list, read_manifest, read_retired_segments, segment_file,
+                               write_manifest, write_retired_segments)
 
 ps = PorterStemmer()
+normalizer = Normalizer(ps)
+
+# bytes of memory used for a SPIMI block, and shared by the buffers of each merge
+DEFAULT_BLOCK_MEMORY = 64 * 1024 * 1024
+
+# tiered compaction of segmented indexes: segments are grouped into tiers of postings sizes growing by
+# SEGMENT_TIER_FACTOR from SEGMENT_TIER_FLOOR bytes, and a tier is merged once it has SEGMENTS_PER_TIER segments
+SEGMENT_TIER_FLOOR = 1024 * 1024
+SEGMENT_TIER_FACTOR = 4
+SEGMENTS_PER_TIER = 4
+# seconds a merged away segment is kept after leaving the manifest, for searches that opened it
+# (forked search workers reopen its postings file by name)
+RETIRED_SEGMENT_GRACE = 10 * 60
+
+# binary postings of terms in more than this fraction of the documents are stored as bitmaps
+DENSE_FRACTION = 1 / 8
+
+# characters of a document read at a time by the tokenizer
+CHUNK_SIZE = 64 * 1024
+
 
 def usage():
-    print("usage: " + sys.argv[0] + " -i directory-of-documents -d dictionary-file -p postings-file")
+    print("usage: " + sys.argv[0] + " -i directory-of-documents -d dictionary-file -p postings-file [-b] [--positions | --frequencies] [--no-sentences]")
+    print("       " + sys.argv[0] + " -i directory-of-documents -s segment-directory [--compact] [--positions | --frequencies] [--no-sentences]")
+    print("       " + sys.argv[0] + " -s segment-directory --compact")
+    print("  -b  write a binary (gap + variable byte encoded) postings file, with bitmaps for terms in many documents")
+    print("  -j  tokenize documents in a pool of N processes")
+    print("  --save-stems  save the stemming cache next to the dictionary to warm up search.py")
+    print("  --fan-in  number of temp files merged at once (default 64)")
+    print(f"  --block-memory  bytes of memory for each SPIMI block and merge (default {DEFAULT_BLOCK_MEMORY})")
+    print("  --append  only index documents newer than the existing index and add them to it")
+    print("  -s  write documents newer than the existing segments as a new segment of a segmented index")
+    print("  --compact  merge small segments of a segmented index into larger ones")
+    print("  --positions  also write the positions of every term in every document, for phrase queries,")
+    print("               and the term frequencies and document lengths of ranked retrieval (search.py --rank)")
+    print("  --frequencies  only write the term frequencies and document lengths of ranked retrieval, without positions")
+    print("  --no-sentences  tokenize words without splitting documents into sentences first (faster, but words")
+    print("                  ending sentences may keep their period); documents are always read in chunks")
+
+
+def read_chunks(f, chunk_size = CHUNK_SIZE):
+    '''
+    generates the text of a file in pieces of about chunk_size characters, each cut after its last whitespace
+    so that no word is split between two pieces (only a word longer than chunk_size is cut, to bound memory)
+    '''
+    carry = ''
+    while True:
+        chunk = f.read(chunk_size)
+        if not chunk:
+            break
+        text = carry + chunk
+        end = len(text)
+        while end and not text[end - 1].isspace():
+            end -= 1
+        if not end:
+            if len(text) <= chunk_size:
+                carry = text
+                continue
+            end = len(text)
+        yield text[:end]
+        carry = text[end:]
+    if carry:
+        yield carry
+
+
+def split_sentences(chunks, chunk_size = CHUNK_SIZE):
+    '''
+    generates the sentences of a stream of text pieces
+    the last sentence of a piece may go on in the next one, so it is carried over and split again with it,
+    unless it grows past chunk_size characters
+    '''
+    carry = ''
+    for chunk in chunks:
+        text = carry + chunk
+        sentences = sent_tokenize(text)
+        if not sentences:
+            carry = ''
+            continue
+        yield from sentences[:-1]
+        # sentences are slices of the text, so the last one starts at its last occurrence
+        carry = text[text.rindex(sentences[-1]):]
+        if len(carry) > chunk_size:
+            yield carry
+            carry = ''
+    if carry:
+        yield carry
+
+
+def tokenize_words(texts, preserve_line = False):
+    '''
+    generates the words of a stream of sentences, or of text pieces if preserve_line (not split into sentences)
+    '''
+    for text in texts:
+        if preserve_line:
+            yield from word_tokenize(text, preserve_line=True)
+        else:
+            yield from word_tokenize(text)
+
+
+def normalize_words(words, normalizer):
+    return map(normalizer.normalize, words)
+
 
+def stream_terms(f, normalizer, sentences = True, chunk_size = CHUNK_SIZE):
+    '''
+    generates the normalized terms of a file, reading chunk_size characters at a time:
+    read_chunks -> split_sentences (if sentences) -> tokenize_words -> normalize_words
+    without the sentence stage, a word ending a sentence may keep its period ("rate.")
+    '''
+    texts = read_chunks(f, chunk_size)
+    if sentences:
+        texts = split_sentences(texts, chunk_size)
+    return normalize_words(tokenize_words(texts, not sentences), normalizer)
+
+
+def tokenize(terms):
+    '''
+    set of the terms of a document, from a stream of its terms
+    '''
+    return set(terms)
 
-def normalize_word(word, ps):
-    return ps.stem(word).lower()
 
-def tokenize(document, ps):
+def tokenize_positions(terms):
     '''
-    generates a list of tokens
+    generates a dictionary of term -> array of its positions (indexes of its tokens in the document)
     '''
-    wordlist = set()
-    for sentence in sent_tokenize(document):
-        for word in word_tokenize(sentence):
-            wordlist.add(normalize_word(word, ps))
-    return wordlist
+    positions = {}
+    for position, term in enumerate(terms):
+        positions.setdefault(term, array('I')).append(position)
+    return positions
+
+
+def tokenize_document(filename, normalizer, positional = False, sentences = True):
+    '''
+    streams a document from its file into its terms (or a dictionary of term -> positions if positional)
+    returns (terms, seconds spent)
+    '''
+    start = time.perf_counter()
+    with open(filename) as f:
+        terms = stream_terms(f, normalizer, sentences)
+        terms = tokenize_positions(terms) if positional else tokenize(terms)
+    return terms, time.perf_counter() - start
 
 def ensure_directory_exists(directory):
     '''
@@ -60,36 +202,62 @@ def write_to_disk(posting):
     directory = "temp"
     ensure_directory_exists(directory)
     with open(directory + os.sep + str(get_write_index(directory)), 'x') as f:
-        for term, doc_id_list in posting.items():
-            doc_ids = SkipLinkedList(" ".join([str(i) for i in doc_id_list]))
+        for term, doc_ids in posting.items():
             doc_ids.update_skip_pointers()
             f.write(f"{term} {doc_ids}\n")
 
-def flush_memory(posting):
-    write_to_disk(dict(sorted(posting.items())))
-    posting.clear()
+def flush_memory(block):
+    write_to_disk(dict(sorted(block.items())))
+    block.clear()
 
 
-def memory_limit_reached(term, posting, document_id, memory_limit):
-    posting_size = sys.getsizeof(posting)
-    term_size = sys.getsizeof(term)
-    document_id_size = sys.getsizeof(document_id)
-    if posting_size + term_size + document_id_size > memory_limit:
-        return True
-    return False
+def index_terms(wordlist, block, memory_limit, document_id):
+    '''
+    adds the terms of a document to the in-memory block, flushing it to disk when full
+    wordlist is a dictionary of term -> positions for positional indexes
+    '''
+    positions = wordlist if isinstance(wordlist, dict) else None
+    for term in wordlist:
+        if block.size >= memory_limit:
+            flush_memory(block)
+        block.add(term, document_id, positions[term] if positions is not None else None)
 
 
-def process_document(filename, posting, memory_limit, document_id, ps):
-    with open(filename) as f:
-        wordlist = tokenize(f.read(), ps)
-        for term in wordlist:
-            if memory_limit_reached(term, posting, document_id, memory_limit):
-                flush_memory(posting)
+def process_document(filename, block, memory_limit, document_id, normalizer, positional = False, sentences = True):
+    '''
+    returns the seconds spent tokenizing the document
+    '''
+    terms, seconds = tokenize_document(filename, normalizer, positional, sentences)
+    index_terms(terms, block, memory_limit, document_id)
+    return seconds
+
+
+# whether worker processes tokenize documents with positions, and split them into sentences
+worker_positional = False
+worker_sentences = True
+
 
-            if term not in posting:
-                posting[term] = []
-            if document_id not in posting[term]:
-                posting[term].append(document_id)
+def init_worker(positional = False, sentences = True):
+    '''
+    worker processes send their new stemming cache entries back with each document
+    '''
+    global worker_positional, worker_sentences
+    normalizer.record_updates = True
+    worker_positional = positional
+    worker_sentences = sentences
+
+
+def tokenize_file(filename):
+    '''
+    tokenizes a document in a worker process using the module level normalizer
+    terms are returned sorted so blocks do not depend on the worker's string hash seed
+    returns (terms, stemming cache updates, seconds spent tokenizing),
+    with terms a dictionary of term -> positions for positional indexes
+    '''
+    terms, seconds = tokenize_document(filename, normalizer, worker_positional, worker_sentences)
+    if worker_positional:
+        return dict(sorted(terms.items())), normalizer.pop_updates(), seconds
+    return sorted(terms), normalizer.pop_updates(), seconds
 
 
 def get_lines(file_path, start, number_of_lines):
@@ -102,7 +270,7 @@ def get_lines(file_path, start, number_of_lines):
         if not line:
             break
         term, doc_ids = line.strip().split(" ", 1)
-        postings.append((term, SkipLinkedList(doc_ids)))
+        postings.append((term, parse_posting(doc_ids)))
     return postings
 
 def print_progress(progress, total_iterations):
@@ -112,153 +280,598 @@ def print_progress(progress, total_iterations):
         print(f'Progress: {progress_percent:.1f}%', end='\r')
 
 
-def select_minimum_posting(inputs):
-    valid_inputs = []
-    for input in inputs:
-        term = input.peek_next_term()
-        if term is not None:
-            valid_inputs.append((term, input))
-
-    if not valid_inputs:
-        return None
-
-    # find the index of the minimum term in the list of valid terms/inputs
-    minimum_index = min(range(len(valid_inputs)), key=lambda i: valid_inputs[i][0])
-
-    _, selected_input = valid_inputs[minimum_index]
-    return selected_input.pop_next_posting()
-
-
-def n_way_merge(files, next_directory):
-    memory_limit = 500000
+def n_way_merge(files, next_directory, memory_limit = DEFAULT_BLOCK_MEMORY):
+    '''
+    merges sorted temp files into a single sorted temp file in next_directory
+    keeps a heap of (next term, input index) so each term costs O(log n) instead of a scan of all inputs
+    memory_limit is split evenly between the input buffers and the output buffer
+    '''
+    buffer_size = memory_limit // (len(files) + 1)
     ensure_directory_exists(next_directory)
     temp_path = os.path.join(next_directory, str(get_write_index(next_directory)))
     with open(temp_path, 'a+') as f:
-        output = OutputBuffer(f, memory_limit)
+        output = OutputBuffer(f, buffer_size)
         inputs = []
         for file in files:
-            inputs.append(InputBuffer(open(file, 'r'), memory_limit))
+            inputs.append(InputBuffer(open(file, 'r'), buffer_size))
+        heap = []
+        for index, input in enumerate(inputs):
+            term = input.peek_next_term()
+            if term is not None:
+                heap.append((term, index))
+        heapq.heapify(heap)
+
         counter = 0
-        while True:
+        current_term = current_posting = None
+        while heap:
+            term, index = heap[0]
+            _, posting = inputs[index].pop_next_posting()
+            next_term = inputs[index].peek_next_term()
+            if next_term is None:
+                heapq.heappop(heap)
+            else:
+                heapq.heapreplace(heap, (next_term, index))
+
+            # postings of the same term from different inputs are combined before writing
+            if term == current_term:
+                current_posting = current_posting.merge(posting)
+                continue
+            if current_term is not None:
+                output.insert((current_term, current_posting))
+            current_term, current_posting = term, posting
             counter += 1
             if counter % 5000 == 0:
                 print(f"{counter} terms sorted!", end='\r')
-            if all(input.is_file_empty() for input in inputs):
-                for input in inputs:
-                    input.close()
-                output.flush()
-                break
-            else:
-                output.insert(select_minimum_posting(inputs))
+        if current_term is not None:
+            output.insert((current_term, current_posting))
+
+        for input in inputs:
+            input.close()
+        output.flush()
 
 
 
-def merge_postings(n, out_postings):
+def merge_postings(n, out_postings, memory_limit = DEFAULT_BLOCK_MEMORY):
     '''
     do n-way recursive merge for temp files created into a single txt, as well as build a dictionary to wordcount and pointers
     returns dictionary (postings are not read but written to)
     '''
+    n = max(2, n)
     current_directory = "temp"
     next_directory = os.path.join(current_directory, "temp")
 
     while len(os.listdir(current_directory)) > 1:
         dir = sorted(os.listdir(current_directory), key=int)
         ensure_directory_exists(next_directory)
-        files = []
-        for i, file in enumerate(dir):
-            files.append(os.path.join(current_directory, file))
-            if i % n == 0 and i != 0:
-                n_way_merge(files, next_directory)
-                files = []
-        # take the leftover
-        if files:
-            n_way_merge(files, next_directory)
+        files = [os.path.join(current_directory, file) for file in dir]
+        for start in range(0, len(files), n):
+            n_way_merge(files[start:start + n], next_directory, memory_limit)
         current_directory = next_directory
         next_directory = os.path.join(current_directory, "temp")
 
     shutil.move(os.path.join(current_directory, "0"), "postings_temp")
 
 
-def build_dictionary(out_postings, out_dict):
+def build_dictionary(out_postings, out_dict, binary = False, out_full_list = 'full_list.txt',
+                     merged_postings = "postings_temp", total_docs = 0, positional = False, frequencies = False):
     '''
     build dictionary of term to (df, pointer) from completed posting list
+    if binary, postings are gap + variable byte encoded and pointers are byte offsets of each record,
+    except for terms in more than DENSE_FRACTION of the total_docs documents, which are stored as bitmaps when smaller
+    if positional or frequencies, the merged postings carry positions, from which the frequency of each term
+    in each document and the length of each document are written for ranked retrieval
+    if positional, the positions themselves are also written to a positions file in dictionary order
     '''
+    ranked = positional or frequencies
     dictionary = {}
-    position = 0
     all_items = set()
-    postings_final = open(out_postings, 'w+')
-    with open("postings_temp") as f:
+    postings_final = open(out_postings, 'wb' if binary else 'w+')
+    if binary:
+        postings_final.write(MAGIC)
+    positions = RecordsWriter(positions_path(out_postings)) if positional else None
+    frequency_records = RecordsWriter(frequencies_path(out_postings), FREQUENCIES_MAGIC) if ranked else None
+    # doc id -> number of tokens
+    lengths = {}
+    stale_paths = [] if positional else [positions_path(out_postings)]
+    if not ranked:
+        stale_paths += [frequencies_path(out_postings), document_lengths_path(out_postings)]
+    for path in stale_paths:
+        if os.path.exists(path):
+            # files of an earlier index in the same place would not match the new dictionary
+            os.remove(path)
+    position = postings_final.tell()
+    with open(merged_postings) as f:
         line = f.readline()
         while line:
             term, doc_ids = line.split(" ", 1)
-            postings_final.write(doc_ids)
-            doc_ids_list = doc_ids.split()
-            all_items.update([int(doc_id.split("^")[0]) for doc_id in doc_ids_list])
+            if binary:
+                posting = parse_posting(doc_ids)
+                doc_ids_list = posting.doc_ids
+                dense = total_docs > 0 and len(doc_ids_list) > DENSE_FRACTION * total_docs
+                postings_final.write(encode_record(doc_ids_list, dense))
+                all_items.update(doc_ids_list)
+            elif ranked:
+                posting = parse_posting(doc_ids)
+                doc_ids_list = PostingList(posting.doc_ids)
+                doc_ids_list.update_skip_pointers()
+                postings_final.write(f"{doc_ids_list}\n")
+                all_items.update(posting.doc_ids)
+            else:
+                postings_final.write(doc_ids)
+                doc_ids_list = doc_ids.split()
+                all_items.update([int(doc_id.split("^")[0]) for doc_id in doc_ids_list])
+            if positional:
+                positions.write(encode_positions(posting.doc_ids, posting.positions))
+            if ranked:
+                term_frequencies = [len(doc_positions) for doc_positions in posting.positions]
+                frequency_records.write(encode_frequencies(term_frequencies))
+                for doc_id, frequency in zip(posting.doc_ids, term_frequencies):
+                    lengths[doc_id] = lengths.get(doc_id, 0) + frequency
             dictionary[term] = (len(doc_ids_list), position)
             position = postings_final.tell()
             line = f.readline()
 
-    with open('full_list.txt', 'wb') as f:
+    with open(out_full_list, 'wb') as f:
         pickle.dump(sorted(all_items), f, protocol=pickle.HIGHEST_PROTOCOL)
 
-    with open(out_dict, 'wb') as f:
-        pickle.dump(dictionary, f, protocol=pickle.HIGHEST_PROTOCOL)
+    if positional:
+        positions.close()
+    if ranked:
+        frequency_records.close()
+        write_document_lengths(document_lengths_path(out_postings), lengths)
+    write_dictionary(out_dict, dictionary)
     postings_final.close()
-    os.remove("postings_temp")
+    os.remove(merged_postings)
+
 
 
+def write_dictionary(out_dict, dictionary):
+    '''
+    writes the term dictionary and, next to it, the k-gram index of its terms for wildcard queries
+    '''
+    write_term_dictionary(out_dict, dictionary)
+    # sorted like the term dictionary, since utf-8 preserves the order of code points
+    write_kgram_index(kgram_index_path(out_dict), sorted(dictionary))
+
 
-def build_index(in_dir, out_dict, out_postings):
+def write_blocks(in_dir, dir, jobs, memory_limit, positional = False, sentences = True):
+    '''
+    tokenizes the documents dir (sorted by doc id) of in_dir into SPIMI blocks written to temp
+    documents are tokenized in a pool of jobs processes if jobs > 1
+    if positional, the positions of the terms in each document are kept in the blocks
+    documents are split into sentences before words if sentences
+    prints the tokenizer throughput per process, from the bytes of the documents and the time spent tokenizing them
+    '''
+    block = SpimiBlock()
+    # clear temp
+    if os.path.exists('temp'):
+        shutil.rmtree('temp')
+    filenames = [in_dir + os.sep + file for file in dir]
+    if jobs > 1:
+        # workers only tokenize; terms come back in doc id order and are added here
+        pool = multiprocessing.Pool(jobs, init_worker, (positional, sentences))
+        wordlists = pool.imap(tokenize_file, filenames, chunksize=max(1, len(filenames) // (jobs * 64)))
+    total_bytes = 0
+    tokenize_seconds = 0.0
+    for i, file in enumerate(dir, 1):
+        if i % max(1, len(dir) // 100) == 0:
+            print(f"{round(i / len(dir) * 100)}% of files read", end='\r')
+        total_bytes += os.path.getsize(filenames[i - 1])
+        if jobs > 1:
+            wordlist, updates, seconds = next(wordlists)
+            normalizer.apply_updates(updates)
+            index_terms(wordlist, block, memory_limit, int(file))
+        else:
+            seconds = process_document(filenames[i - 1], block, memory_limit, int(file), normalizer, positional,
+                                       sentences)
+        tokenize_seconds += seconds
+    if jobs > 1:
+        pool.close()
+        pool.join()
+    if tokenize_seconds:
+        print(f"tokenized {total_bytes / 1e6:.1f} MB at {total_bytes / 1e6 / tokenize_seconds:.2f} MB/s per core")
+    #Flush remaining postings to disk and get pointers
+    flush_memory(block)
+    print(f"{len(os.listdir('temp'))} temp files created. merging:")
+
+
+def build_index(in_dir, out_dict, out_postings, binary = False, jobs = 1, save_stems = False, fan_in = 64,
+                memory_limit = DEFAULT_BLOCK_MEMORY, positional = False, sentences = True, frequencies = False):
     """
     build index from documents stored in the input directory,
     then output the dictionary file and postings file
+    documents are tokenized in a pool of jobs processes if jobs > 1
+    the stemming cache is saved next to the dictionary if save_stems
+    temp files are merged fan_in at a time
+    blocks are flushed to disk when they hold memory_limit bytes
+    if positional, a positions file is written next to the postings file
+    if positional or frequencies, so are term frequency and document length files for ranked retrieval
+    documents are split into sentences before words if sentences
     """
     print('indexing...')
-    ps = PorterStemmer()
-    memory_limit = 500000
     # sort once first so sorting posting list on insertion is not necessary
     dir = sorted(os.listdir(in_dir), key=int)
-    posting = {}
-    i = 0
-    # clear temp
+    # frequencies are counted from the positions of the terms in the blocks
+    write_blocks(in_dir, dir, jobs, memory_limit, positional or frequencies, sentences)
+    merge_postings(fan_in, out_postings, memory_limit)
+    print("building dictionary:")
+    build_dictionary(out_postings, out_dict, binary, total_docs=len(dir), positional=positional,
+                     frequencies=frequencies)
+    print(f"stemming cache: {normalizer}")
+    if save_stems:
+        normalizer.save(stem_cache_path(out_dict))
+    print(f"dictionary and postings file created at {out_dict} and {out_postings}.\n Indexing complete!")
     if os.path.exists('temp'):
         shutil.rmtree('temp')
-    for file in dir:
-        i += 1
-        if i % (len(dir) // 100) == 0:
-            print(f"{round(i / len(dir) * 100)}% of files read", end='\r')
-        filename = in_dir + os.sep + file
-        process_document(filename, posting, memory_limit, int(file), ps)
-    #Flush remaining postings to disk and get pointers
-    flush_memory(posting)
-    print("temp files created. merging:")
-    merge_postings(3, out_postings)
+
+
+def append_postings(out_postings, dictionary, total_docs = 0, deltas = None):
+    '''
+    adds the merged delta postings in postings_temp to an existing postings file and its dictionary
+    new doc ids are all larger than the indexed ones, so an updated posting is the old one followed by the delta
+    the postings file is written again in the order of the updated dictionary, like the positions and term
+    frequency files (see append_positions), so it keeps no unused records; text postings of terms without new
+    documents are copied as they are, binary ones are encoded again since postings of terms in more than
+    DENSE_FRACTION of the total_docs documents are written as bitmaps when smaller
+    positional delta postings are also kept in deltas by term, if given
+    returns the sorted list of new doc ids
+    '''
+    existing_postings = Postings(out_postings, dictionary)
+    binary = existing_postings.binary
+    all_items = set()
+    delta_postings = {}
+    with open("postings_temp") as f:
+        for line in f:
+            term, doc_ids = line.split(" ", 1)
+            posting = parse_posting(doc_ids)
+            all_items.update(posting.doc_ids)
+            if deltas is not None and isinstance(posting, PositionalPostingList):
+                deltas[term] = posting
+                posting = PostingList(posting.doc_ids)
+            delta_postings[term] = posting
+    # written next to the old file and swapped in, so searches that mapped the old file can keep reading it
+    with open(out_postings, 'rb') as old_postings, open(out_postings + ".tmp", 'wb') as postings_final:
+        if binary:
+            postings_final.write(MAGIC)
+        for term in sorted(dictionary.keys() | delta_postings.keys()):
+            posting = delta_postings.get(term)
+            position = postings_final.tell()
+            if posting is None and not binary:
+                old_postings.seek(dictionary[term][1])
+                postings_final.write(old_postings.readline())
+                dictionary[term] = (dictionary[term][0], position)
+                continue
+            if posting is None:
+                posting = existing_postings.read_posting(term)
+            elif term in dictionary:
+                posting = PostingList(existing_postings.read_posting(term).doc_ids + posting.doc_ids)
+            if binary:
+                dense = total_docs > 0 and posting.length > DENSE_FRACTION * total_docs
+                postings_final.write(encode_record(posting.doc_ids, dense))
+            else:
+                posting.update_skip_pointers()
+                postings_final.write(f"{posting}\n".encode())
+            dictionary[term] = (posting.length, position)
+    existing_postings.close()
+    os.replace(out_postings + ".tmp", out_postings)
+    os.remove("postings_temp")
+    return sorted(all_items)
+
+
+def append_positions(out_postings, old_dictionary, dictionary, deltas):
+    '''
+    writes the positions (if the index has them) and term frequency files of an index again
+    in the order of its updated dictionary
+    records of terms without new documents are copied as they are, the others are decoded,
+    extended with the positional delta postings of the new documents and encoded again
+    the lengths of the new documents are added to the document lengths
+    '''
+    old_positions = load_positional_index(positions_path(out_postings), old_dictionary)
+    old_frequencies = TermFrequencies(frequencies_path(out_postings), old_dictionary)
+    positions = RecordsWriter(positions_path(out_postings)) if old_positions else None
+    frequencies = RecordsWriter(frequencies_path(out_postings), FREQUENCIES_MAGIC)
+    lengths = load_document_lengths(document_lengths_path(out_postings))
+    for term in sorted(dictionary):
+        delta = deltas.get(term)
+        if delta is None:
+            if positions:
+                positions.write(old_positions.record(term))
+            frequencies.write(old_frequencies.record(term))
+            continue
+        if positions:
+            entries = old_positions.get_positions(term)
+            positions.write(encode_positions(array('I', [doc_id for doc_id, _ in entries]) + delta.doc_ids,
+                                             [doc_positions for _, doc_positions in entries] + delta.positions))
+        delta_frequencies = [len(doc_positions) for doc_positions in delta.positions]
+        frequencies.write(encode_frequencies(list(old_frequencies.get_frequencies(term)[1]) + delta_frequencies))
+        for doc_id, frequency in zip(delta.doc_ids, delta_frequencies):
+            lengths[doc_id] = lengths.get(doc_id, 0) + frequency
+    if positions:
+        positions.close()
+        old_positions.close()
+    frequencies.close()
+    write_document_lengths(document_lengths_path(out_postings), lengths)
+    old_frequencies.close()
+
+
+def append_index(in_dir, out_dict, out_postings, jobs = 1, save_stems = False, fan_in = 64,
+                 memory_limit = DEFAULT_BLOCK_MEMORY, sentences = True):
+    """
+    indexes only the documents of the input directory newer than the largest indexed doc id
+    as a delta, then adds it to the existing dictionary, postings file and full list
+    the postings file, and the positions and term frequency files of an index with positions or frequencies,
+    are written again with the postings of the new documents added, so no unused records are left behind;
+    the records of terms without new documents are copied or encoded again without being merged
+    """
+    print('appending...')
+    # the dictionary is updated in memory and written again
+    old_dictionary = load_term_dictionary(out_dict)
+    dictionary = dict(old_dictionary.items())
+    # frequencies are kept by every positional index, and by those built with only frequencies
+    ranked = os.path.exists(frequencies_path(out_postings))
+    with open('full_list.txt', 'rb') as f:
+        full_list = pickle.load(f)
+    last_doc_id = full_list[-1] if full_list else -1
+    dir = sorted([file for file in os.listdir(in_dir) if int(file) > last_doc_id], key=int)
+    if not dir:
+        print("no new documents to index")
+        return
+
+    normalizer.load(stem_cache_path(out_dict))
+    write_blocks(in_dir, dir, jobs, memory_limit, ranked, sentences)
+    merge_postings(fan_in, out_postings, memory_limit)
+    print("updating dictionary:")
+    deltas = {} if ranked else None
+    full_list.extend(append_postings(out_postings, dictionary, len(full_list) + len(dir), deltas))
+    if ranked:
+        append_positions(out_postings, old_dictionary, dictionary, deltas)
+
+    with open('full_list.txt', 'wb') as f:
+        pickle.dump(full_list, f, protocol=pickle.HIGHEST_PROTOCOL)
+
+    write_dictionary(out_dict, dictionary)
+    print(f"stemming cache: {normalizer}")
+    if save_stems:
+        normalizer.save(stem_cache_path(out_dict))
+    print(f"{len(dir)} documents added to {out_dict} and {out_postings}.\n Indexing complete!")
+    if os.path.exists('temp'):
+        shutil.rmtree('temp')
+
+def build_segment(in_dir, directory, binary = False, jobs = 1, save_stems = False, fan_in = 64,
+                  memory_limit = DEFAULT_BLOCK_MEMORY, positional = False, sentences = True, frequencies = False):
+    """
+    indexes the documents of the input directory newer than every live segment of a segmented index
+    into a new immutable segment, and adds it to the manifest
+    if positional, the segment also gets a positions file, and if positional or frequencies, ranking files
+    """
+    print('indexing new segment...')
+    ensure_directory_exists(directory)
+    stems_path = stem_cache_path(os.path.join(directory, DICTIONARY_FILE))
+    normalizer.load(stems_path)
+    last_doc_id = -1
+    for segment in read_manifest(directory):
+        full_list = load_full_list(directory, segment)
+        if full_list:
+            last_doc_id = max(last_doc_id, full_list[-1])
+    dir = sorted([file for file in os.listdir(in_dir) if int(file) > last_doc_id], key=int)
+    if not dir:
+        print("no new documents to index")
+        return
+
+    write_blocks(in_dir, dir, jobs, memory_limit, positional or frequencies, sentences)
+    merge_postings(fan_in, None, memory_limit)
     print("building dictionary:")
-    build_dictionary(out_postings, out_dict)
-    print(f"dictionary and postings file created at {out_dict} and {out_postings}.\n Indexing complete!")
+    segment = create_segment(directory)
+    build_dictionary(segment_file(directory, segment, POSTINGS_FILE), segment_file(directory, segment, DICTIONARY_FILE),
+                     binary, segment_file(directory, segment, FULL_LIST_FILE), total_docs=len(dir), positional=positional,
+                     frequencies=frequencies)
+    with ManifestLock(directory):
+        write_manifest(directory, read_manifest(directory) + [segment])
+    print(f"stemming cache: {normalizer}")
+    if save_stems:
+        normalizer.save(stems_path)
+    print(f"{len(dir)} documents written to segment {segment} of {directory}.\n Indexing complete!")
     if os.path.exists('temp'):
         shutil.rmtree('temp')
 
-input_directory = output_file_dictionary = output_file_postings = None
-
-try:
-    opts, args = getopt.getopt(sys.argv[1:], 'i:d:p:')
-except getopt.GetoptError:
-    usage()
-    sys.exit(2)
-
-for o, a in opts:
-    if o == '-i': # input directory
-        input_directory = a
-    elif o == '-d': # dictionary file
-        output_file_dictionary = a
-    elif o == '-p': # postings file
-        output_file_postings = a
-    else:
-        assert False, "unhandled option"
 
-if input_directory == None or output_file_postings == None or output_file_dictionary == None:
-    usage()
-    sys.exit(2)
+def dump_segment(directory, segment, out_file, positional = False, frequencies = False):
+    '''
+    writes the postings of a segment as sorted "term postings" lines, the format of the SPIMI temp files
+    with their positions if positional, or if only frequencies, with positions 0 to frequency - 1 standing in
+    for the positions, since only their number is read
+    returns whether the segment's postings are binary
+    '''
+    postings = Postings(segment_file(directory, segment, POSTINGS_FILE), load_dictionary(directory, segment))
+    with open(out_file, 'w') as f:
+        for term in sorted(postings.dictionary):
+            posting = postings.read_posting(term)
+            if positional:
+                posting = PositionalPostingList(posting.doc_ids, [positions for _, positions in
+                                                                  postings.get_positions(term)])
+            elif frequencies:
+                posting = PositionalPostingList(posting.doc_ids, [array('I', range(frequency)) for frequency in
+                                                                  postings.get_frequencies(term)[1]])
+            posting.update_skip_pointers()
+            f.write(f"{term} {posting}\n")
+    postings.close()
+    return postings.binary
+
+
+def select_segments_to_merge(directory, segments):
+    '''
+    tiered merge policy: returns the first run of adjacent segments in the manifest, all in a tier at most t,
+    with SEGMENTS_PER_TIER segments, for the smallest such t, or an empty list if there is none
+    only adjacent segments are merged, so that the manifest stays in doc id order
+    '''
+    tiers = []
+    for segment in segments:
+        size = os.path.getsize(segment_file(directory, segment, POSTINGS_FILE))
+        tier = 0
+        while size >= SEGMENT_TIER_FLOOR * SEGMENT_TIER_FACTOR ** (tier + 1):
+            tier += 1
+        tiers.append(tier)
+    for top_tier in sorted(set(tiers)):
+        run = []
+        for segment, tier in zip(segments, tiers):
+            if tier > top_tier:
+                if len(run) >= SEGMENTS_PER_TIER:
+                    return run
+                run = []
+            else:
+                run.append(segment)
+        if len(run) >= SEGMENTS_PER_TIER:
+            return run
+    return []
+
+
+def merge_segments(directory, segments, memory_limit = DEFAULT_BLOCK_MEMORY):
+    '''
+    merges adjacent segments of the manifest into a single new segment with n_way_merge, then swaps it into the manifest
+    the old segments are retired rather than deleted, so searches that already opened them keep reading them
+    the merged segment is positional (or has frequencies) if all the segments are (or have)
+    '''
+    work_directory = tempfile.mkdtemp(dir=directory)
+    files = []
+    binary = False
+    total_docs = 0
+    positional = all(os.path.exists(positions_path(segment_file(directory, segment, POSTINGS_FILE)))
+                     for segment in segments)
+    frequencies = all(os.path.exists(frequencies_path(segment_file(directory, segment, POSTINGS_FILE)))
+                      for segment in segments)
+    for i, segment in enumerate(segments):
+        files.append(os.path.join(work_directory, str(i)))
+        binary = dump_segment(directory, segment, files[-1], positional, frequencies) or binary
+        total_docs += len(load_full_list(directory, segment))
+    merged_directory = os.path.join(work_directory, "merged")
+    n_way_merge(files, merged_directory, memory_limit)
+
+    merged_segment = create_segment(directory)
+    build_dictionary(segment_file(directory, merged_segment, POSTINGS_FILE),
+                     segment_file(directory, merged_segment, DICTIONARY_FILE), binary,
+                     segment_file(directory, merged_segment, FULL_LIST_FILE), os.path.join(merged_directory, "0"),
+                     total_docs, positional, frequencies)
+    shutil.rmtree(work_directory)
+
+    with ManifestLock(directory):
+        live_segments = read_manifest(directory)
+        position = live_segments.index(segments[0])
+        live_segments = [segment for segment in live_segments if segment not in segments]
+        live_segments.insert(position, merged_segment)
+        write_manifest(directory, live_segments)
+        retired_at = time.time()
+        write_retired_segments(directory, read_retired_segments(directory) +
+                               [(segment, retired_at) for segment in segments])
+    print(f"merged {len(segments)} segments into {merged_segment}")
+
+
+def delete_retired_segments(directory, grace = RETIRED_SEGMENT_GRACE):
+    '''
+    deletes the segments retired by merges more than grace seconds ago
+    searches open every file of their segments under the shared manifest lock, so they keep reading deleted ones
+    '''
+    with ManifestLock(directory):
+        retired = read_retired_segments(directory)
+        now = time.time()
+        kept = []
+        for segment, retired_at in retired:
+            if now - retired_at >= grace:
+                shutil.rmtree(os.path.join(directory, segment), ignore_errors=True)
+            else:
+                kept.append((segment, retired_at))
+        if len(kept) < len(retired):
+            write_retired_segments(directory, kept)
+    if retired:
+        print(f"deleted {len(retired) - len(kept)} retired segments, {len(kept)} kept for running searches")
 
-build_index(input_directory, output_file_dictionary, output_file_postings)
+
+def compact_segments(directory, fan_in = 64, memory_limit = DEFAULT_BLOCK_MEMORY):
+    '''
+    merges segments of a segmented index under the tiered policy until no tier is full
+    segments are immutable and the manifest is swapped atomically,
+    so this can run in the background while searching and indexing
+    segments retired by earlier compactions are deleted first
+    '''
+    delete_retired_segments(directory)
+    while True:
+        segments = select_segments_to_merge(directory, read_manifest(directory))
+        if not segments:
+            break
+        merge_segments(directory, segments[:max(2, fan_in)], memory_limit)
+    print(f"{len(read_manifest(directory))} live segments in {directory}")
+
+
+if __name__ == '__main__':
+    input_directory = output_file_dictionary = output_file_postings = None
+    binary_postings = False
+    jobs = 1
+    save_stems = False
+    fan_in = 64
+    block_memory = DEFAULT_BLOCK_MEMORY
+    append = False
+    segment_directory = None
+    compact = False
+    positional = False
+    frequencies = False
+    sentences = True
+
+    try:
+        opts, args = getopt.getopt(sys.argv[1:], 'i:d:p:bj:s:', ['save-stems', 'fan-in=', 'block-memory=', 'append',
+                                                                 'compact', 'positions', 'frequencies', 'no-sentences'])
+    except getopt.GetoptError:
+        usage()
+        sys.exit(2)
+
+    for o, a in opts:
+        if o == '-i': # input directory
+            input_directory = a
+        elif o == '-d': # dictionary file
+            output_file_dictionary = a
+        elif o == '-p': # postings file
+            output_file_postings = a
+        elif o == '-b': # binary postings file
+            binary_postings = True
+        elif o == '-j': # number of tokenizing processes
+            jobs = int(a)
+        elif o == '--save-stems':
+            save_stems = True
+        elif o == '--fan-in':
+            fan_in = int(a)
+        elif o == '--block-memory':
+            block_memory = int(a)
+        elif o == '--append':
+            append = True
+        elif o == '-s': # segmented index directory
+            segment_directory = a
+        elif o == '--compact':
+            compact = True
+        elif o == '--positions':
+            positional = True
+        elif o == '--frequencies':
+            frequencies = True
+        elif o == '--no-sentences':
+            sentences = False
+        else:
+            assert False, "unhandled option"
+
+    if segment_directory != None:
+        if input_directory == None and not compact:
+            usage()
+            sys.exit(2)
+        if input_directory != None:
+            build_segment(input_directory, segment_directory, binary_postings, jobs, save_stems, fan_in, block_memory,
+                          positional, sentences, frequencies)
+        if compact:
+            compact_segments(segment_directory, fan_in, block_memory)
+        sys.exit(0)
+
+    if input_directory == None or output_file_postings == None or output_file_dictionary == None:
+        usage()
+        sys.exit(2)
+
+    if append and os.path.exists(output_file_dictionary):
+        append_index(input_directory, output_file_dictionary, output_file_postings, jobs, save_stems, fan_in,
+                     block_memory, sentences)
+    else:
+        build_index(input_directory, output_file_dictionary, output_file_postings, binary_postings, jobs, save_stems,
+                    fan_in, block_memory, positional, sentences, frequencies)
@@ -5,75 +5,245 @@ import re
 import nltk
 import sys
 import getopt
+import multiprocessing
 
-from Postings import Postings
-from QueryParser import QueryParser
-from SkipLinkedList import SkipLinkedList
+from Normalizer import Normalizer, stem_cache_path
+from Postings import MappedPostings, Postings
+from QueryParser import ENGINES, QueryParser
+from Ranker import PRUNING, SCHEMES
+from PostingList import PostingList
+from SegmentedPostings import DICTIONARY_FILE, SegmentedPostings
+from KGramIndex import kgram_index_path, load_kgram_index
+from TermDictionary import load_term_dictionary
 
 
 def usage():
-    print("usage: " + sys.argv[0] + " -d dictionary-file -p postings-file -q file-of-queries -o output-file-of-results")
-
-
-def initialize(dict_path, postings_path, full_list_path):
+    print("usage: " + sys.argv[0] + " -d dictionary-file -p postings-file -q file-of-queries -o output-file-of-results [-m] [-c cache-bytes] [-r cache-bytes] [-j jobs] [-x] [-e engine] [--limit k | --count] [--stats]")
+    print("       " + sys.argv[0] + " -s segment-directory -q file-of-queries -o output-file-of-results [-m] [-c cache-bytes] [-r cache-bytes] [-j jobs] [-x] [-e engine] [--limit k | --count] [--stats]")
+    print("       " + sys.argv[0] + " (-d dictionary-file -p postings-file | -s segment-directory) -q file-of-queries -o output-file-of-results --rank scheme [--top k] [--prune strategy] [-m] [-c cache-bytes] [-j jobs] [--stats]")
+    print("  -m  memory-map the postings file instead of seeking and reading it")
+    print("  -c  keep up to cache-bytes of decoded postings in an LRU cache")
+    print("  -s  search every live segment of a segmented index")
+    print("  -j  evaluate queries in a pool of N processes")
+    print("  -r  keep up to cache-bytes of subexpression results in an LRU cache shared by the batch (per process with -j)")
+    print("  -x  write the EXPLAIN output (query plan with estimated sizes and costs) of each query instead of its results")
+    print(f"  -e  evaluation engine, one of {', '.join(ENGINES)} (numpy requires the numpy package, default array)")
+    print("  --limit  write only the first k doc ids of each query, evaluating no more than needed for them")
+    print("  --count  write only the number of results of each query")
+    print("  --stats  print the terms wildcards expanded to, the time spent expanding and unioning them,")
+    print("           and the time spent comparing the positions of phrases, per query")
+    print(f"  --rank   rank the documents for free text queries by {' or '.join(SCHEMES)}, in indexes built with --frequencies or --positions")
+    print("  --top    write the k best documents of each ranked query, best first (default 10)")
+    print(f"  --prune  skip documents that cannot make the top k with {' or '.join(PRUNING[:-1])}, or none (default wand)")
+    print("  query terms may contain * wildcards (econom*), expanded with the k-gram index of the dictionary")
+    print("  quoted phrases (\"interest rate\") match consecutive terms, in indexes built with --positions")
+
+
+def initialize(dict_path, postings_path, full_list_path, mapped = False, cache_budget = 0):
     '''
     initializes dictionary and a file object for the postings file for seeking and reading from
-    also initializes a full_list as a SkipLinkedList if it doesn't already exist
+    (or a memory map of the postings file if mapped), caching up to cache_budget bytes of postings
+    also initializes a full_list as a PostingList if it doesn't already exist
     '''
-    with open(dict_path, 'rb') as f:
-        dictionary = pickle.load(f)
+    dictionary = load_term_dictionary(dict_path)
+    kgram_index = load_kgram_index(kgram_index_path(dict_path))
+
+    if mapped:
+        postings = MappedPostings(postings_path, dictionary, cache_budget, kgram_index)
+    else:
+        postings = Postings(postings_path, dictionary, cache_budget, kgram_index)
 
     if os.path.exists(full_list_path):
         with open(full_list_path, 'rb') as f:
-            full_list = SkipLinkedList(pickle.load(f))
+            full_list = PostingList(pickle.load(f))
     else:
         all_items = set()
-        with open(postings_path) as f:
-            line = f.readline()
-            while line:
-                term, doc_ids = line.split(" ", 1)
-                all_items.update([int(doc_id.split("^")[0]) for doc_id in doc_ids.split()])
-        full_list = sorted(all_items)
-
-    postings = Postings(postings_path, dictionary)
+        for term in dictionary:
+            all_items.update(postings.get_posting(term))
+        full_list = PostingList(sorted(all_items))
 
     return postings, full_list
 
 
-def run_search(dict_file, postings_file, queries_file, results_file):
-    full_list_dir = "full_list.txt"
-    postings, full_list = initialize(dict_file, postings_file, full_list_dir)
-    query_parser = QueryParser(postings, full_list)
-    with open(queries_file) as f, open(os.path.join(results_file), 'w+') as w:
-        for line in f:
-            w.write(f"{query_parser.resolve_query(line)}\n")
+def initialize_segments(segment_directory, mapped = False, cache_budget = 0):
+    '''
+    initializes postings over the live segments of a segmented index and their full list
+    '''
+    postings = SegmentedPostings(segment_directory, mapped, cache_budget)
+    return postings, postings.get_full_list()
 
-    print("Search complete!")
 
+def load_query_parser(dict_file = None, postings_file = None, segment_directory = None, mapped = False,
+                      cache_budget = 0, result_cache_budget = 0, engine = 'array'):
+    '''
+    loads an index (a dictionary and postings file, or a segmented index) and its stemming cache
+    returns a QueryParser over it
+    '''
+    if segment_directory:
+        postings, full_list = initialize_segments(segment_directory, mapped, cache_budget)
+        dict_file = os.path.join(segment_directory, DICTIONARY_FILE)
+    else:
+        full_list_dir = "full_list.txt"
+        postings, full_list = initialize(dict_file, postings_file, full_list_dir, mapped, cache_budget)
+    normalizer = Normalizer()
+    normalizer.load(stem_cache_path(dict_file))
+    return QueryParser(postings, full_list, normalizer, result_cache_budget, engine)
 
 
-dictionary_file = postings_file = file_of_queries = output_file_of_results = None
+# query parser of a batch worker process; inherited from the parent when processes are forked,
+# so the dictionary and full list are shared copy-on-write instead of loaded again
+worker_query_parser = None
 
-try:
-    opts, args = getopt.getopt(sys.argv[1:], 'd:p:q:o:')
-except getopt.GetoptError:
-    usage()
-    sys.exit(2)
 
-for o, a in opts:
-    if o == '-d':
-        dictionary_file  = a
-    elif o == '-p':
-        postings_file = a
-    elif o == '-q':
-        file_of_queries = a
-    elif o == '-o':
-        file_of_output = a
+def init_search_worker(index_args):
+    global worker_query_parser
+    if worker_query_parser is None:
+        worker_query_parser = load_query_parser(*index_args)
     else:
-        assert False, "unhandled option"
+        # each worker needs a postings file handle of its own
+        worker_query_parser.postings.reopen()
+
+
+def resolve_in_worker(query_args):
+    '''
+    resolves (query, limit, count, ranking) with ranking (k, scheme, pruning) for ranked queries or None
+    '''
+    line, limit, count, ranking = query_args
+    stats = {}
+    if ranking:
+        return worker_query_parser.rank_query(line, *ranking, stats=stats), stats
+    return worker_query_parser.resolve_query(line, limit, count, stats), stats
+
+
+def format_stats(stats):
+    '''
+    one line of the stats of a query, as kept by QueryParser
+    '''
+    if not stats:
+        return "invalid query"
+    if 'rank_time' in stats:
+        return f"{stats['scored_documents']} documents scored in {stats['rank_time'] * 1000:.2f}ms"
+    return (f"{stats['expanded_terms']} terms expanded in {stats['expansion_time'] * 1000:.2f}ms, "
+            f"union {stats['union_time'] * 1000:.2f}ms, phrase positions {stats['phrase_time'] * 1000:.2f}ms")
+
+
+def run_search(dict_file, postings_file, queries_file, results_file, mapped = False, cache_budget = 0,
+               segment_directory = None, jobs = 1, result_cache_budget = 0, explain = False, engine = 'array',
+               limit = None, count = False, stats = False, ranking = None):
+    '''
+    writes one line of results for each query, streamed in pieces when queries are evaluated in this process
+    only the first limit doc ids of each query are written if limit is given, or the number of results if count
+    if ranking is (k, scheme, pruning), queries are free text and the k best doc ids of each are written instead
+    prints the stats of each query if stats
+    '''
+    global worker_query_parser
+    index_args = (dict_file, postings_file, segment_directory, mapped, cache_budget, result_cache_budget, engine)
+    query_parser = load_query_parser(*index_args)
+    if ranking and not query_parser.postings.has_frequencies():
+        print("ranked retrieval needs an index built with --frequencies or --positions")
+        return
+    with open(queries_file) as f, open(os.path.join(results_file), 'w+') as w:
+        if explain:
+            for line in f:
+                w.write(f"EXPLAIN {line.strip()}\n{query_parser.explain_query(line)}\n\n")
+        elif jobs > 1:
+            worker_query_parser = query_parser
+            with multiprocessing.Pool(jobs, init_search_worker, (index_args,)) as pool:
+                # imap returns results in the order of the queries
+                results = pool.imap(resolve_in_worker, ((line, limit, count, ranking) for line in f), chunksize=16)
+                for i, (result, query_stats) in enumerate(results, 1):
+                    w.write(f"{result}\n")
+                    if stats:
+                        print(f"query {i}: {format_stats(query_stats)}")
+        else:
+            for i, line in enumerate(f, 1):
+                query_stats = {}
+                if ranking:
+                    w.write(query_parser.rank_query(line, *ranking, stats=query_stats))
+                else:
+                    for piece in query_parser.stream_query(line, limit, count, stats=query_stats):
+                        w.write(piece)
+                w.write("\n")
+                if stats:
+                    print(f"query {i}: {format_stats(query_stats)}")
+
+    if jobs == 1 or explain:
+        if cache_budget:
+            print(f"posting cache: {query_parser.postings.cache}")
+        if result_cache_budget:
+            print(f"result cache: {query_parser.results}")
+        print(f"stemming cache: {query_parser.normalizer}")
+    print("Search complete!")
+
 
-if dictionary_file == None or postings_file == None or file_of_queries == None or file_of_output == None :
-    usage()
-    sys.exit(2)
 
-run_search(dictionary_file, postings_file, file_of_queries, file_of_output)
+if __name__ == '__main__':
+    dictionary_file = postings_file = file_of_queries = file_of_output = None
+    mapped_postings = False
+    cache_budget = 0
+    segment_directory = None
+    jobs = 1
+    result_cache_budget = 0
+    explain = False
+    engine = 'array'
+    limit = None
+    count = False
+    stats = False
+    scheme = None
+    top = 10
+    pruning = 'wand'
+
+    try:
+        opts, args = getopt.getopt(sys.argv[1:], 'd:p:q:o:mc:s:j:r:xe:',
+                                   ['limit=', 'count', 'stats', 'rank=', 'top=', 'prune='])
+    except getopt.GetoptError:
+        usage()
+        sys.exit(2)
+
+    for o, a in opts:
+        if o == '-d':
+            dictionary_file  = a
+        elif o == '-p':
+            postings_file = a
+        elif o == '-q':
+            file_of_queries = a
+        elif o == '-o':
+            file_of_output = a
+        elif o == '-m':
+            mapped_postings = True
+        elif o == '-c':
+            cache_budget = int(a)
+        elif o == '-s':
+            segment_directory = a
+        elif o == '-j':
+            jobs = int(a)
+        elif o == '-r':
+            result_cache_budget = int(a)
+        elif o == '-x':
+            explain = True
+        elif o == '-e':
+            engine = a
+        elif o == '--limit':
+            limit = int(a)
+        elif o == '--count':
+            count = True
+        elif o == '--stats':
+            stats = True
+        elif o == '--rank':
+            scheme = a
+        elif o == '--top':
+            top = int(a)
+        elif o == '--prune':
+            pruning = a
+        else:
+            assert False, "unhandled option"
+
+    if (segment_directory == None and (dictionary_file == None or postings_file == None)) or \
+            file_of_queries == None or file_of_output == None or engine not in ENGINES or \
+            (scheme != None and scheme not in SCHEMES) or pruning not in PRUNING:
+        usage()
+        sys.exit(2)
+
+    run_search(dictionary_file, postings_file, file_of_queries, file_of_output, mapped_postings, cache_budget,
+               segment_directory, jobs, result_cache_budget, explain, engine, limit, count, stats,
+               (top, scheme, pruning) if scheme else None)
@@ -0,0 +1,87 @@
+#!/usr/bin/python3
+import getopt
+import socketserver
+import sys
+
+from QueryParser import ENGINES
+from search import load_query_parser
+
+
+def usage():
+    print("usage: " + sys.argv[0] + " -d dictionary-file -p postings-file [--host host] [--port port] [-c cache-bytes] [-r cache-bytes] [-e engine]")
+    print("       " + sys.argv[0] + " -s segment-directory [--host host] [--port port] [-c cache-bytes] [-r cache-bytes] [-e engine]")
+    print("loads the index once, then answers one line of results for each line of query sent over TCP")
+
+
+class QueryHandler(socketserver.StreamRequestHandler):
+    '''
+    line-oriented protocol: every line received is a Boolean query,
+    answered with one line of space separated doc ids (empty if there are none or the query is invalid)
+    '''
+    def handle(self):
+        for line in self.rfile:
+            result = self.server.query_parser.resolve_query(line.decode().strip())
+            self.wfile.write(f"{result}\n".encode())
+            self.wfile.flush()
+
+
+class QueryServer(socketserver.ThreadingMixIn, socketserver.TCPServer):
+    '''
+    serves every client connection in its own thread from a single preloaded index
+    postings are memory-mapped so the threads can share them
+    '''
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, address, query_parser):
+        super().__init__(address, QueryHandler)
+        self.query_parser = query_parser
+
+
+if __name__ == '__main__':
+    dictionary_file = postings_file = segment_directory = None
+    host = "127.0.0.1"
+    port = 3245
+    cache_budget = 0
+    result_cache_budget = 0
+    engine = 'array'
+
+    try:
+        opts, args = getopt.getopt(sys.argv[1:], 'd:p:s:c:r:e:', ['host=', 'port='])
+    except getopt.GetoptError:
+        usage()
+        sys.exit(2)
+
+    for o, a in opts:
+        if o == '-d':
+            dictionary_file = a
+        elif o == '-p':
+            postings_file = a
+        elif o == '-s':
+            segment_directory = a
+        elif o == '-c':
+            cache_budget = int(a)
+        elif o == '-r':
+            result_cache_budget = int(a)
+        elif o == '-e':
+            engine = a
+        elif o == '--host':
+            host = a
+        elif o == '--port':
+            port = int(a)
+        else:
+            assert False, "unhandled option"
+
+    if (segment_directory == None and (dictionary_file == None or postings_file == None)) or engine not in ENGINES:
+        usage()
+        sys.exit(2)
+
+    # postings are memory-mapped so the connection threads can share them
+    query_parser = load_query_parser(dictionary_file, postings_file, segment_directory, True, cache_budget,
+                                     result_cache_budget, engine)
+    with QueryServer((host, port), query_parser) as server:
+        print(f"serving queries on {host}:{server.server_address[1]}")
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass